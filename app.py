@@ -5,24 +5,86 @@ from datetime import datetime, timedelta
 import io
 from pathlib import Path
 import warnings
-from openpyxl import Workbook
-from openpyxl.styles import Font
+import xlsxwriter
 import os
 import json
+import hashlib
+import numbers
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import DataStore, dataset_cache, get_backend
+from comments_store import CommentStore, report_key, report_keys
+from journal import RegistryJournal
+from snapshots import SnapshotStore
+from artifact_cache import artifact_key, get_artifact_cache
+from column_profile import column_statistics, profile_columns, reference_info
+from completeness import CompletenessRules
+from jobs import JOB_CANCELLED, JOB_DONE, get_job_runner
+from ingest import (
+    EXCEL_EXTENSIONS, HEADER_SAMPLE_ROWS, aggregate_request_history_csv, format_read_timing,
+    read_csv, read_excel, read_header_sample
+)
+from type_inference import DEFAULT_SAMPLE_SIZE, detect_column_types, detect_data_type
 
 warnings.filterwarnings('ignore')
 
 # Константы для хранения данных
 DATA_DIR = Path("Дашборд")
-REPORTS_DATA_FILE = DATA_DIR / "reports_data.xlsx"
+
+# Формат канонических копий данных: parquet, arrow или excel
+STORAGE_FORMAT = os.environ.get("REPORTS_STORAGE_FORMAT", "parquet")
+
+# Хранилище таблиц (создает директорию, если её нет)
+data_store = DataStore(DATA_DIR, get_backend(STORAGE_FORMAT))
+
+REPORTS_TABLE = "reports_data"
+REPORTS_DATA_FILE = data_store.path(REPORTS_TABLE)
+
+# Журнал правок реестра поверх снимка REPORTS_DATA_FILE
+REPORTS_JOURNAL_FILE = DATA_DIR / "reports_journal.jsonl"
+reports_journal = RegistryJournal(REPORTS_JOURNAL_FILE)
+
+# Комментарии к отчетам (comments_data.json — формат предыдущих версий)
+COMMENTS_DB_FILE = DATA_DIR / "comments.db"
 COMMENTS_DATA_FILE = DATA_DIR / "comments_data.json"
+comment_store = CommentStore(COMMENTS_DB_FILE)
 
 # Добавьте новые константы для анализатора запросов
-REQUESTS_DATA_FILE = DATA_DIR / "requests_data.xlsx"
-REQUESTS_PROCESSED_FILE = DATA_DIR / "requests_processed.xlsx"
+REQUESTS_TABLE = "requests_data"
+REQUESTS_PROCESSED_TABLE = "requests_processed"
+REQUESTS_DATA_FILE = data_store.path(REQUESTS_TABLE)
+REQUESTS_PROCESSED_FILE = data_store.path(REQUESTS_PROCESSED_TABLE)
+
+# Предрасчитанные артефакты дашборда (хранятся рядом с реестром)
+DASHBOARD_KPI_TABLE = "dashboard_kpi"
+DASHBOARD_CONFIRMATION_TABLE = "dashboard_confirmation"
+DASHBOARD_UPDATE_TABLE = "dashboard_update"
+DASHBOARD_BREAKDOWN_TABLE = "dashboard_breakdown"
+DASHBOARD_ARTIFACTS_META_FILE = DATA_DIR / "dashboard_artifacts.json"
+
+# История загрузок (версии реестра и выгрузок запросов)
+HISTORY_DIR = DATA_DIR / "history"
+snapshot_store = SnapshotStore(HISTORY_DIR, data_store.backend)
+
+# Фоновая обработка загруженных файлов (состояния задач хранятся на диске)
+JOBS_DIR = DATA_DIR / "jobs"
+ingestion_jobs = get_job_runner(JOBS_DIR)
+
+# Кэш сформированных атрибутных составов (ключ — хэш файла и параметры преобразования)
+ATTRIBUTE_CACHE_DIR = DATA_DIR / "cache" / "attributes"
+attribute_cache = get_artifact_cache(ATTRIBUTE_CACHE_DIR, backend=data_store.backend)
+
+# Текст из загруженных файлов пишется в xlsx как есть: строки вида "=..." не
+# становятся формулами (formula injection), адреса — ссылками, цифры — числами
+XLSXWRITER_TEXT_OPTIONS = {'strings_to_formulas': False, 'strings_to_urls': False, 'strings_to_numbers': False}
 
-# Создаем директорию если её нет
-DATA_DIR.mkdir(exist_ok=True)
+# CSV-выгрузки запросов больше этого размера читаются потоково, фрагментами
+REQUESTS_STREAMING_MIN_BYTES = 50 * 1024 * 1024
+
+# Столбцы, которые хранятся как даты
+REPORTS_DATE_COLUMNS = ['Дата создания последнего черновика', 'Дата последней публикации отчета']
+REQUESTS_DATE_COLUMNS = ['created_at', 'ts_from', 'ts_to']
 
 # Конфигурация страницы
 st.set_page_config(
@@ -37,64 +99,128 @@ if 'admin_mode' not in st.session_state:
     st.session_state.admin_mode = False
 
 # Функции для работы с данными
-def save_reports_data(df, comments=None):
-    """Сохранение данных отчетов в постоянный файл"""
+def save_reports_data(df):
+    """
+    Сохранение данных отчетов в постоянный файл
+    
+    Вместе со снимком пересчитываются артефакты дашборда, поэтому загруженный
+    файл сохраняется один раз, а не при каждом перезапуске страницы
+    (см. show_admin_dashboard).
+    """
     try:
-        # Сохраняем основные данные
-        df.to_excel(REPORTS_DATA_FILE, index=False)
-        
-        # Сохраняем комментарии
-        if comments:
-            with open(COMMENTS_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(comments, f, ensure_ascii=False, indent=2)
-        
-        return True
+        # Сохраняем основные данные (комментарии хранятся отдельно в comment_store).
+        # Новый снимок заменяет и все накопленные в журнале правки
+        with reports_journal.locked():
+            data_store.write(REPORTS_TABLE, df, date_columns=REPORTS_DATE_COLUMNS)
+            reports_journal.reset()
     except Exception as e:
         st.error(f"Ошибка при сохранении данных: {str(e)}")
         return False
+    finally:
+        # Другие сессии перечитают данные из общего кэша
+        dataset_cache.invalidate(REPORTS_TABLE)
+    
+    # Артефакты дашборда считаем один раз при загрузке, а не при каждом просмотре
+    try:
+        stored_df, version = read_shared_reports_data()
+        save_dashboard_artifacts(build_dashboard_artifacts(stored_df), version)
+    except Exception as e:
+        st.warning(f"⚠️ Показатели дашборда будут пересчитаны при открытии: {str(e)}")
+    
+    return True
+
+def read_shared_reports_data():
+    """Снимок реестра с примененным журналом правок из общего кэша процесса"""
+    return dataset_cache.get(
+        REPORTS_TABLE,
+        [REPORTS_DATA_FILE, REPORTS_JOURNAL_FILE],
+        lambda: reports_journal.load(data_store, REPORTS_TABLE)
+    )
+
+def read_shared_requests_data():
+    """Исходные и обработанные данные анализатора из общего кэша процесса"""
+    return dataset_cache.get(
+        REQUESTS_TABLE,
+        [REQUESTS_DATA_FILE, REQUESTS_PROCESSED_FILE],
+        lambda: (data_store.read(REQUESTS_TABLE), data_store.read(REQUESTS_PROCESSED_TABLE))
+    )
+
+def read_shared_requests_processed():
+    """
+    Обработанные данные анализатора из общего кэша процесса
+    
+    Полная история стадий (исходные данные) может занимать миллионы строк,
+    поэтому для отображения читаются только обработанные данные, а история
+    загружается через read_shared_requests_data там, где она нужна.
+    """
+    return dataset_cache.get(
+        REQUESTS_PROCESSED_TABLE,
+        [REQUESTS_PROCESSED_FILE],
+        lambda: data_store.read(REQUESTS_PROCESSED_TABLE)
+    )
+
+def write_requests_data(original_df, processed_df):
+    """Запись данных анализатора запросов без вывода в интерфейс (для фоновых задач)"""
+    # Таблицы запросов пишутся по одной задаче за раз (см. JobRunner.resource_lock)
+    with ingestion_jobs.resource_lock(REQUESTS_TABLE):
+        try:
+            # Сохраняем исходные данные
+            data_store.write(REQUESTS_TABLE, original_df, date_columns=REQUESTS_DATE_COLUMNS)
+            
+            # Сохраняем обработанные данные
+            data_store.write(REQUESTS_PROCESSED_TABLE, processed_df)
+        finally:
+            dataset_cache.invalidate(REQUESTS_TABLE)
+            dataset_cache.invalidate(REQUESTS_PROCESSED_TABLE)
 
 def save_requests_data(original_df, processed_df):
     """Сохранение данных анализатора запросов в постоянные файлы"""
     try:
-        # Сохраняем исходные данные
-        original_df.to_excel(REQUESTS_DATA_FILE, index=False)
-        
-        # Сохраняем обработанные данные
-        processed_df.to_excel(REQUESTS_PROCESSED_FILE, index=False)
-        
+        write_requests_data(original_df, processed_df)
         return True
     except Exception as e:
         st.error(f"Ошибка при сохранении данных анализатора: {str(e)}")
         return False
 
+def save_report_cell(key, column, value):
+    """Сохранение правки одной ячейки реестра через журнал изменений"""
+    try:
+        entries_count = reports_journal.append_cell_edit(key, column, value)
+        dataset_cache.invalidate(REPORTS_TABLE)
+        
+        # Накопившиеся правки сворачиваем в новый снимок в фоне
+        if entries_count >= reports_journal.compact_threshold:
+            reports_journal.compact_in_background(
+                data_store, REPORTS_TABLE,
+                date_columns=REPORTS_DATE_COLUMNS,
+                on_done=lambda: dataset_cache.invalidate(REPORTS_TABLE)
+            )
+        return True
+    except Exception as e:
+        st.error(f"Ошибка при сохранении изменения: {str(e)}")
+        return False
+
 def load_requests_data():
-    """Загрузка данных анализатора запросов из постоянных файлов"""
-    original_df = None
+    """Загрузка обработанных данных анализатора запросов из постоянных файлов"""
     processed_df = None
     
     try:
-        # Загружаем исходные данные
-        if REQUESTS_DATA_FILE.exists():
-            original_df = pd.read_excel(REQUESTS_DATA_FILE)
-        
-        # Загружаем обработанные данные
-        if REQUESTS_PROCESSED_FILE.exists():
-            processed_df = pd.read_excel(REQUESTS_PROCESSED_FILE)
+        # Обработанные данные берем из общего для всех сессий кэша
+        processed_df, _ = read_shared_requests_processed()
     
     except Exception as e:
         st.error(f"Ошибка при загрузке данных анализатора: {str(e)}")
     
-    return original_df, processed_df
+    return processed_df
 
 def init_requests_data():
     """Инициализация данных анализатора запросов при запуске приложения"""
-    if 'requests_data_initialized' not in st.session_state:
-        original_df, processed_df = load_requests_data()
+    # Перечитываем данные только если файлы изменились (например, после загрузки другим админом)
+    version = dataset_cache.version([REQUESTS_PROCESSED_FILE])
+    if st.session_state.get('requests_data_version') != version:
+        st.session_state.request_processed_data = load_requests_data()
         
-        st.session_state.request_original_data = original_df
-        st.session_state.request_processed_data = processed_df
-        
-        st.session_state.requests_data_initialized = True
+        st.session_state.requests_data_version = version
 
 def load_reports_data():
     """Загрузка данных отчетов из постоянного файла"""
@@ -102,25 +228,39 @@ def load_reports_data():
     comments = {}
     
     try:
-        # Загружаем основные данные
-        if REPORTS_DATA_FILE.exists():
-            df = pd.read_excel(REPORTS_DATA_FILE)
+        # Загружаем снимок с примененным журналом правок
+        # (общий объект для всех сессий, только для чтения)
+        df, _ = read_shared_reports_data()
         
-        # Загружаем комментарии
-        if COMMENTS_DATA_FILE.exists():
-            with open(COMMENTS_DATA_FILE, 'r', encoding='utf-8') as f:
-                comments_data = json.load(f)
-                # Конвертируем строковые ключи обратно в int
-                comments = {int(k): v for k, v in comments_data.items()}
+        # Загружаем комментарии по ключу (Номер формы, Наименование отчета)
+        comments = comment_store.load_all()
     
     except Exception as e:
         st.error(f"Ошибка при загрузке данных: {str(e)}")
     
     return df, comments
 
+def migrate_legacy_data():
+    """Однократный перенос xlsx-файлов из предыдущих версий в канонический формат"""
+    try:
+        data_store.migrate_legacy_excel(REPORTS_TABLE, date_columns=REPORTS_DATE_COLUMNS)
+        data_store.migrate_legacy_excel(REQUESTS_TABLE, date_columns=REQUESTS_DATE_COLUMNS)
+        data_store.migrate_legacy_excel(REQUESTS_PROCESSED_TABLE)
+        
+        # Комментарии из JSON привязываем к отчетам текущего реестра
+        if COMMENTS_DATA_FILE.exists():
+            comment_store.migrate_from_json(COMMENTS_DATA_FILE, data_store.read(REPORTS_TABLE))
+    except Exception as e:
+        st.error(f"Ошибка при миграции данных: {str(e)}")
+
 def init_dashboard_data():
     """Инициализация данных дашборда при запуске приложения"""
     if 'reports_data_initialized' not in st.session_state:
+        migrate_legacy_data()
+    
+    # Перечитываем данные только если файлы изменились
+    version = (dataset_cache.version([REPORTS_DATA_FILE, REPORTS_JOURNAL_FILE]), comment_store.revision())
+    if st.session_state.get('reports_data_version') != version:
         df, comments = load_reports_data()
         
         if df is not None:
@@ -130,6 +270,7 @@ def init_dashboard_data():
             st.session_state.reports_data = None
             st.session_state.reports_comments = {}
         
+        st.session_state.reports_data_version = version
         st.session_state.reports_data_initialized = True
     
     # Добавляем инициализацию данных анализатора
@@ -264,103 +405,55 @@ st.markdown("""
 
 # Класс ExcelTransformer
 class ExcelTransformer:
-    def __init__(self, report_number=None):
+    # Версия преобразования: увеличивается при изменении метаданных или вида xlsx,
+    # чтобы не выдавать из кэша результаты предыдущей версии
+    VERSION = 4
+    
+    # Лист профиля столбцов: технические названия -> заголовки
+    PROFILE_COLUMNS = {
+        'ReportCode_info': 'Код атрибута отчета',
+        'name': 'Наименование атрибута',
+        'base_type_report_field': 'Базовый тип атрибута',
+        'filled_count': 'Заполнено значений',
+        'null_share': 'Доля пустых',
+        'distinct_count': 'Различных значений',
+        'min_value': 'Минимум',
+        'max_value': 'Максимум',
+        'min_length': 'Мин. длина',
+        'max_length': 'Макс. длина',
+        'mean_length': 'Средняя длина',
+        'example': 'Пример значения'
+    }
+    
+    def __init__(self, report_number=None, type_sample_size=None):
         """
         Инициализация трансформера
         
         Args:
             report_number (str): Номер отчета для генерации кодов атрибутов
+            type_sample_size (int): размер выборки для определения типов столбцов
+                (по умолчанию None — столбец всегда просматривается целиком;
+                выборка, например DEFAULT_SAMPLE_SIZE, включается явно)
         """
         self.report_number = report_number or "R001"
-        self.supported_extensions = ['.xlsx', '.xls', '.csv']
+        self.type_sample_size = type_sample_size
+        self.supported_extensions = list(EXCEL_EXTENSIONS) + ['.csv']
         self.report_types = ["Ручной", "Полуавтоматический", "Автоматический", "ИЛА"]
     
     def detect_data_type(self, values):
         """
         Автоматическое определение типа данных столбца
         
+        Столбец проверяется целиком, правила разбора дат и чисел описаны
+        в type_inference.
+        
         Args:
             values: pandas Series с данными столбца
             
         Returns:
             str: тип данных ('текст', 'число', 'дата', 'флаг')
         """
-        # Убираем пустые значения и NaN
-        clean_values = values.dropna()
-        if len(clean_values) == 0:
-            return "текст"
-        
-        # Конвертируем в строки для анализа
-        str_values = clean_values.astype(str).str.strip().str.lower()
-        
-        # Проверка на булевы значения (флаги)
-        bool_indicators = {
-            'да', 'нет', 'true', 'false', '1', '0', 'yes', 'no', 
-            'y', 'n', 'вкл', 'выкл', 'on', 'off', 'активен', 'неактивен'
-        }
-        unique_values = set(str_values.unique())
-        if unique_values.issubset(bool_indicators) and len(unique_values) <= 3:
-            return "флаг"
-        
-        # Проверка на даты
-        date_count = 0
-        for val in clean_values:
-            if self._is_date(val):
-                date_count += 1
-        
-        if date_count / len(clean_values) > 0.7:  # 70% значений - даты
-            return "дата"
-        
-        # Проверка на числа
-        numeric_count = 0
-        for val in clean_values:
-            if self._is_numeric(val):
-                numeric_count += 1
-        
-        if numeric_count / len(clean_values) > 0.8:  # 80% значений - числа
-            return "число"
-        
-        return "текст"
-    
-    def _is_date(self, value):
-        """Проверка, является ли значение датой"""
-        if pd.isna(value):
-            return False
-            
-        # Попробуем распарсить как дату
-        date_formats = [
-            '%d.%m.%Y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y',
-            '%d.%m.%y', '%d/%m/%y', '%y-%m-%d', '%d-%m-%y',
-            '%Y.%m.%d', '%Y/%m/%d'
-        ]
-        
-        str_val = str(value).strip()
-        
-        for fmt in date_formats:
-            try:
-                datetime.strptime(str_val, fmt)
-                return True
-            except ValueError:
-                continue
-                
-        # Проверим pandas to_datetime
-        try:
-            pd.to_datetime(str_val, errors='raise')
-            return True
-        except:
-            return False
-    
-    def _is_numeric(self, value):
-        """Проверка, является ли значение числом"""
-        if pd.isna(value):
-            return False
-            
-        try:
-            # Попробуем конвертировать в float
-            float(str(value).replace(',', '.').replace(' ', ''))
-            return True
-        except ValueError:
-            return False
+        return detect_data_type(values)
     
     def load_from_uploaded_file(self, uploaded_file):
         """
@@ -376,35 +469,37 @@ class ExcelTransformer:
             file_extension = Path(uploaded_file.name).suffix.lower()
             
             if file_extension == '.csv':
-                # Для CSV пробуем разные разделители и кодировки
-                try:
-                    df = pd.read_csv(uploaded_file, sep=',', encoding='utf-8')
-                    if len(df.columns) > 1:
-                        return df
-                except:
-                    pass
-                
-                try:
-                    uploaded_file.seek(0)  # Сброс указателя файла
-                    df = pd.read_csv(uploaded_file, sep=';', encoding='cp1251')
-                    if len(df.columns) > 1:
-                        return df
-                except:
-                    pass
-                
-                # Последняя попытка
-                uploaded_file.seek(0)
-                df = pd.read_csv(uploaded_file)
+                # Кодировка и разделитель определяются по началу файла, файл разбирается один раз
+                df = read_csv(uploaded_file)
                 
             else:
-                # Для Excel файлов
-                df = pd.read_excel(uploaded_file)
+                # Для Excel файлов (быстрый движок, если установлен)
+                df = read_excel(uploaded_file)
             
             return df
             
         except Exception as e:
             raise Exception(f"Ошибка при загрузке файла: {str(e)}")
     
+    def load_header_sample(self, uploaded_file, nrows=HEADER_SAMPLE_ROWS):
+        """
+        Облегченная загрузка: названия столбцов и первые nrows строк
+        
+        Для атрибутного состава нужны только столбцы и образец данных,
+        поэтому файл целиком не разбирается.
+        
+        Args:
+            uploaded_file: файл, загруженный через st.file_uploader
+            nrows (int): количество строк данных (None — все строки)
+            
+        Returns:
+            tuple: (pandas.DataFrame с первыми строками, общее число строк или None)
+        """
+        try:
+            return read_header_sample(uploaded_file.getvalue(), uploaded_file.name, nrows)
+        except Exception as e:
+            raise Exception(f"Ошибка при загрузке файла: {str(e)}")
+    
     def transform_to_metadata(self, df, report_type):
         """
         Преобразование DataFrame в метаданные атрибутов
@@ -414,16 +509,23 @@ class ExcelTransformer:
             report_type (str): тип отчета (Ручной, Полуавтоматический, Автоматический, ИЛА)
             
         Returns:
-            pandas.DataFrame: метаданные атрибутов
+            pandas.DataFrame: метаданные атрибутов (столбец type_confidence — уверенность
+            в определенном типе, и статистика значений из PROFILE_COLUMNS в файл
+            атрибутного состава выгружаются только на лист профиля)
         """
         metadata_list = []
         
-        for idx, column in enumerate(df.columns, 1):
-            # Получаем данные столбца
-            column_data = df[column]
-            
-            # Определяем тип данных
-            data_type = self.detect_data_type(column_data)
+        # Типы всех столбцов (для широких шаблонов — параллельно, порядок сохраняется)
+        column_types = detect_column_types(df, self.type_sample_size)
+        # Число различных и самые частые значения — для поиска справочных атрибутов
+        column_sketches = profile_columns(df)
+        # Доля пустых, минимум/максимум, длины и пример значения — по каждому столбцу целиком
+        column_stats = column_statistics(df, [data_type for data_type, _ in column_types])
+        
+        for idx, (column, (data_type, type_confidence), sketch, stats) in enumerate(
+            zip(df.columns, column_types, column_sketches, column_stats.itertuples(index=False)), 1
+        ):
+            ref_indicator, code_table = reference_info(sketch, data_type)
             
             # Определяем значения по умолчанию в зависимости от типа отчета
             if report_type in ["Ручной", "Полуавтоматический"]:
@@ -454,10 +556,19 @@ class ExcelTransformer:
                 'reportfields_domain': '',
                 'required_attribute_info': 'да',
                 'base_type_report_field': data_type,
-                'base_calc_ref_ind_info': 'Базовый',
-                'codeTable_info': '',
-                'example': '',
-                'isToDelete_info': ''
+                'base_calc_ref_ind_info': ref_indicator,
+                'codeTable_info': code_table,
+                'example': stats.example,
+                'isToDelete_info': '',
+                'type_confidence': type_confidence,
+                'filled_count': stats.filled,
+                'null_share': stats.null_share,
+                'distinct_count': sketch.distinct_count(),
+                'min_value': stats.min_value,
+                'max_value': stats.max_value,
+                'min_length': stats.min_length,
+                'max_length': stats.max_length,
+                'mean_length': stats.mean_length
             }
             
             metadata_list.append(metadata_record)
@@ -471,23 +582,19 @@ class ExcelTransformer:
         
         return metadata_df
     
-    def create_excel_download(self, metadata_df):
+    def create_excel_download(self, metadata_df, include_profile=False):
         """
         Создание Excel файла для скачивания с заголовками и пользовательскими названиями
         
         Args:
             metadata_df (pandas.DataFrame): метаданные для сохранения
+            include_profile (bool): добавить лист со статистикой значений столбцов
             
         Returns:
             bytes: данные Excel файла
         """
         output = io.BytesIO()
         
-        # Создаем новую книгу Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Атрибут отчета"
-        
         # Технические заголовки (скрытая строка)
         technical_headers = [
             'ReportCode_info', 'Noreportfield_info', 'name', 'description', 'TechAsIs', 
@@ -523,56 +630,241 @@ class ExcelTransformer:
             'Помечен к удалению (да/нет)'
         ]
         
-        # Записываем технические заголовки в первую строку (скрытую)
-        for col_idx, header in enumerate(technical_headers, 1):
-            ws.cell(row=1, column=col_idx, value=header)
+        # Данные только по столбцам шаблона, пустые значения — пустые ячейки
+        data = metadata_df[technical_headers]
+        rows = data.astype(object).where(data.notna(), None).to_dict('split')['data']
+        
+        # Ширина столбцов по самому длинному значению (с учетом обеих строк заголовков)
+        widths = []
+        for col_idx, header in enumerate(technical_headers):
+            max_length = max(len(header), len(user_headers[col_idx]))
+            if not data.empty:
+                max_length = max(max_length, int(data[header].dropna().astype(str).str.len().max() or 0))
+            widths.append(min(max_length + 2, 50))
         
-        # Скрываем первую строку
-        ws.row_dimensions[1].hidden = True
+        # Потоковая запись: строки сбрасываются на диск по мере записи, память не растет
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True, **XLSXWRITER_TEXT_OPTIONS})
+        ws = wb.add_worksheet("Атрибут отчета")
+        bold = wb.add_format({'bold': True})
         
-        # Записываем пользовательские заголовки во вторую строку (видимую)
-        for col_idx, header in enumerate(user_headers, 1):
-            cell = ws.cell(row=2, column=col_idx, value=header)
-            # Делаем заголовки полужирными
-            cell.font = Font(bold=True)
+        for col_idx, width in enumerate(widths):
+            ws.set_column(col_idx, col_idx, width)
         
         # Закрепляем первые две строки
-        ws.freeze_panes = ws.cell(row=3, column=1)
+        ws.freeze_panes(2, 0)
+        
+        # Технические заголовки в первой строке (скрытой)
+        ws.set_row(0, None, None, {'hidden': True})
+        ws.write_row(0, 0, technical_headers)
+        
+        # Пользовательские заголовки во второй строке (видимой, полужирные)
+        ws.write_row(1, 0, user_headers, bold)
         
         # Записываем данные начиная с третьей строки
-        for row_idx, (_, row) in enumerate(metadata_df.iterrows(), 3):
-            for col_idx, value in enumerate(row, 1):
-                ws.cell(row=row_idx, column=col_idx, value=value)
+        for row_idx, values in enumerate(rows, 2):
+            ws.write_row(row_idx, 0, values)
         
-        # Автоподбор ширины столбцов (учитываем все строки включая заголовки)
-        for col_idx, column_letter in enumerate([chr(65 + i) for i in range(len(technical_headers))], 0):
-            max_length = 0
-            
-            # Проверяем техническую строку
-            if len(technical_headers) > col_idx:
-                if len(str(technical_headers[col_idx])) > max_length:
-                    max_length = len(str(technical_headers[col_idx]))
-            
-            # Проверяем пользовательскую строку
-            if len(user_headers) > col_idx:
-                if len(str(user_headers[col_idx])) > max_length:
-                    max_length = len(str(user_headers[col_idx]))
-            
-            # Проверяем данные
-            for row_idx in range(3, len(metadata_df) + 3):
-                cell_value = ws.cell(row=row_idx, column=col_idx + 1).value
-                if cell_value and len(str(cell_value)) > max_length:
-                    max_length = len(str(cell_value))
-            
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
+        if include_profile:
+            self._write_profile_sheet(wb, metadata_df, bold)
         
-        # Сохраняем в BytesIO
-        wb.save(output)
-        output.seek(0)
+        wb.close()
         return output.getvalue()
 
+    def _write_profile_sheet(self, wb, metadata_df, header_format):
+        """Лист со статистикой значений столбцов шаблона"""
+        ws = wb.add_worksheet("Профиль столбцов")
+        percent = wb.add_format({'num_format': '0.0%'})
+        decimal = wb.add_format({'num_format': '0.0'})
+        
+        columns = list(self.PROFILE_COLUMNS)
+        for col_idx, column in enumerate(columns):
+            cell_format = {'null_share': percent, 'mean_length': decimal}.get(column)
+            ws.set_column(col_idx, col_idx, max(len(self.PROFILE_COLUMNS[column]) + 2, 14), cell_format)
+        ws.freeze_panes(1, 0)
+        ws.write_row(0, 0, list(self.PROFILE_COLUMNS.values()), header_format)
+        
+        data = metadata_df[columns]
+        for row_idx, values in enumerate(data.astype(object).where(data.notna(), None).to_dict('split')['data'], 1):
+            ws.write_row(row_idx, 0, values)
+
+# Пакетное формирование атрибутов
+ATTRIBUTE_FILE_EXTENSIONS = EXCEL_EXTENSIONS + ('.csv',)
+ATTRIBUTE_BATCH_WORKERS = 4
+# Символы, недопустимые в имени файла внутри архива (разделители путей, запрещенные в Windows, управляющие)
+UNSAFE_FILE_NAME_PATTERN = r'[\\/:*?"<>|\x00-\x1f]'
+
+def read_attribute_sources(uploaded_files):
+    """
+    Список шаблонов из загруженных файлов и zip-архивов
+    
+    Returns:
+        list: пары (имя файла, содержимое)
+    """
+    sources = []
+    for uploaded_file in uploaded_files:
+        if not uploaded_file.name.lower().endswith('.zip'):
+            sources.append((uploaded_file.name, uploaded_file.getvalue()))
+            continue
+        
+        with zipfile.ZipFile(io.BytesIO(uploaded_file.getvalue())) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                # Архивы из Windows хранят русские имена в cp866 без флага UTF-8
+                if not info.flag_bits & 0x800:
+                    try:
+                        name = name.encode('cp437').decode('cp866')
+                    except (UnicodeEncodeError, UnicodeDecodeError):
+                        pass
+                if info.is_dir() or name.startswith('__MACOSX/'):
+                    continue
+                if Path(name).suffix.lower() in ATTRIBUTE_FILE_EXTENSIONS:
+                    sources.append((Path(name).name, archive.read(info)))
+    return sources
+
+def build_attribute_workbook(transformer, file_hash, report_type, load_sample, include_profile=False,
+                             sample_rows=HEADER_SAMPLE_ROWS):
+    """
+    Метаданные и xlsx атрибутного состава с кэшированием на диске
+    
+    Args:
+        transformer (ExcelTransformer): трансформер с номером отчета
+        file_hash (str): SHA-256 содержимого загруженного файла
+        report_type (str): тип отчета
+        load_sample: функция без аргументов, возвращающая образец данных файла
+            (вызывается только если результата нет в кэше)
+        include_profile (bool): добавить в xlsx лист профиля столбцов
+        sample_rows (int): сколько первых строк файла читает load_sample
+            (None — файл целиком); входит в ключ кэша
+            
+    Returns:
+        tuple: (DataFrame метаданных, xlsx в байтах)
+    """
+    key = artifact_key(
+        file_hash, transformer.report_number, report_type,
+        ExcelTransformer.VERSION, transformer.type_sample_size, include_profile, sample_rows
+    )
+    cached = attribute_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    metadata_df = transformer.transform_to_metadata(load_sample(), report_type)
+    excel_data = transformer.create_excel_download(metadata_df, include_profile=include_profile)
+    try:
+        attribute_cache.put(key, metadata_df, excel_data)
+    except OSError:
+        # Кэш не обязателен: без записи на диск результат просто будет пересчитан
+        pass
+    return metadata_df, excel_data
+
+def generate_attributes_for_file(file_name, data, report_number, report_type, include_profile=False,
+                                 sample_rows=HEADER_SAMPLE_ROWS, type_sample_size=None):
+    """
+    Атрибутный состав одного шаблона (для пакетной обработки)
+    
+    Типы и профиль столбцов определяются по первым sample_rows строкам
+    файла (None — по всем строкам); type_sample_size — размер выборки для
+    определения типов (см. ExcelTransformer).
+    
+    Returns:
+        dict: результат со статусом; ошибка одного файла не прерывает пакет
+    """
+    result = {
+        'Файл': file_name,
+        'Номер отчета': report_number,
+        'Тип отчета': report_type,
+        'Статус': 'Ошибка',
+        'Атрибутов': 0,
+        'Основной тип': '',
+        'Файл в архиве': '',
+        'Ошибка': '',
+        'excel_data': None
+    }
+    try:
+        transformer = ExcelTransformer(report_number=report_number, type_sample_size=type_sample_size)
+        metadata_df, excel_data = build_attribute_workbook(
+            transformer, hashlib.sha256(data).hexdigest(), report_type,
+            lambda: read_header_sample(data, file_name, sample_rows)[0], include_profile, sample_rows
+        )
+        
+        type_stats = metadata_df['base_type_report_field'].value_counts()
+        result.update({
+            'Статус': 'Готово',
+            'Атрибутов': len(metadata_df),
+            'Основной тип': type_stats.index[0] if len(type_stats) > 0 else "N/A",
+            'excel_data': excel_data
+        })
+    except Exception as e:
+        result['Ошибка'] = str(e)
+    return result
+
+def safe_archive_name(report_number):
+    """
+    Имя xlsx атрибутного состава в архиве по номеру отчета
+    
+    Номер вводится пользователем, поэтому разделители путей и другие
+    недопустимые символы заменяются, а точки и пробелы по краям убираются:
+    запись не может оказаться во вложенной папке или вне архива.
+    """
+    base = re.sub(UNSAFE_FILE_NAME_PATTERN, '_', str(report_number)).strip(' .')[:100] or "отчет"
+    return f"{base}_атрибуты"
+
+def build_attributes_zip(jobs, max_workers=ATTRIBUTE_BATCH_WORKERS, on_progress=None, include_profile=False,
+                         sample_rows=HEADER_SAMPLE_ROWS, type_sample_size=None):
+    """
+    Пакетное формирование атрибутных составов
+    
+    Args:
+        jobs (list): кортежи (имя файла, содержимое, номер отчета, тип отчета)
+        max_workers (int): количество одновременно обрабатываемых файлов
+        on_progress: необязательная функция (обработано, всего)
+        include_profile (bool): добавить в каждый xlsx лист профиля столбцов
+        sample_rows (int): сколько первых строк каждого файла анализировать (None — все)
+        type_sample_size (int): размер выборки для определения типов (None — без выборки)
+        
+    Returns:
+        tuple: (zip-архив в байтах, DataFrame со сводкой по файлам)
+    """
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(generate_attributes_for_file, *job, include_profile, sample_rows, type_sample_size): pos for pos, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_progress is not None:
+                on_progress(done, len(jobs))
+    
+    output = io.BytesIO()
+    used_names = set()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if result['excel_data'] is None:
+                continue
+            # Одинаковые номера отчетов не должны перезаписывать друг друга
+            # (без учета регистра — при распаковке в Windows имена совпадут)
+            base_name = safe_archive_name(result['Номер отчета'])
+            archive_name = f"{base_name}.xlsx"
+            suffix = 2
+            while archive_name.lower() in used_names:
+                archive_name = f"{base_name}_{suffix}.xlsx"
+                suffix += 1
+            used_names.add(archive_name.lower())
+            result['Файл в архиве'] = archive_name
+            archive.writestr(archive_name, result['excel_data'])
+        
+        summary_df = pd.DataFrame([
+            {key: value for key, value in result.items() if key != 'excel_data'} for result in results
+        ])
+        summary_output = io.BytesIO()
+        with pd.ExcelWriter(summary_output, engine='xlsxwriter', engine_kwargs={'options': XLSXWRITER_TEXT_OPTIONS}) as writer:
+            summary_df.to_excel(writer, sheet_name='Сводка', index=False)
+        archive.writestr("Сводка.xlsx", summary_output.getvalue())
+    
+    return output.getvalue(), summary_df
+
 # Функции для дашборда
+
+# Правила полноты реестра (общие для процента заполнения и рекомендаций)
+completeness_rules = CompletenessRules()
+
 def calculate_completion_percentage(df, owner_filter=None):
     """Расчет процента заполнения полей"""
     if df is None or df.empty:
@@ -585,149 +877,209 @@ def calculate_completion_percentage(df, owner_filter=None):
     if df.empty:
         return 0, 0
     
-    total_cells = 0
-    filled_cells = 0
-    
-    for _, row in df.iterrows():
-        for col in df.columns:
-            # Исключения для расчета
-            participation_value = row.get('Участие в формировании РФ', '')
-            if col == 'ССП, в функциональном подчинении которого, находятся сотрудники РФ' and str(participation_value).lower() == 'нет':
-                continue
-            frequency_value = row.get('Частота отчета', '')
-            if col == 'Частота отчета (ручной ввод)' and str(frequency_value).lower() != 'ручной ввод':
-                continue
-            
-            total_cells += 1
-            if pd.notna(row[col]) and str(row[col]).strip() != '':
-                filled_cells += 1
+    report = completeness_rules.evaluate(df)
+    return report.completion_rate(), report.published_rate()
+
+def get_actualization_dates(df):
+    """Даты последней публикации и актуализации (+1 год) по отчетам с датой публикации"""
+    columns = ['Номер формы', 'Наименование отчета', 'Владелец отчета ССП']
+    date_col = 'Дата последней публикации отчета'
+    if date_col not in df.columns:
+        return pd.DataFrame(columns=columns + ['pub_date', 'actualization_date'])
+    
+    publication = df[date_col]
+    if pd.api.types.is_datetime64_any_dtype(publication):
+        pub_dates = publication
+    else:
+        # Столбец разбирается один раз; числа и нераспознанные строки пропускаются
+        is_number = publication.map(lambda value: isinstance(value, numbers.Number))
+        pub_dates = pd.to_datetime(publication.where(~is_number), format='mixed', errors='coerce')
+    
+    has_date = pub_dates.notna()
+    result = pd.DataFrame({
+        col: df.loc[has_date, col] if col in df.columns else '' for col in columns
+    }, index=df.index[has_date])
+    result['pub_date'] = pub_dates[has_date]
+    result['actualization_date'] = result['pub_date'] + pd.Timedelta(days=365)  # +1 год
+    return result.reset_index(drop=True)
+
+def format_confirmation_reports(dates_df, current_date):
+    """Отбор отчетов со сроком актуализации в ближайшие 60 дней и форматирование статуса"""
+    if dates_df.empty:
+        return pd.DataFrame()
     
-    completion_rate = (filled_cells / total_cells * 100) if total_cells > 0 else 0
+    actualization_dates = pd.to_datetime(dates_df['actualization_date'])
+    days_until_actualization = (actualization_dates - pd.Timestamp(current_date)).dt.days
     
-    # Процент опубликованных отчетов
-    published_count = len(df[df['Этап отчета'] == 'Опубликован'])
-    total_reports = len(df)
-    published_rate = (published_count / total_reports * 100) if total_reports > 0 else 0
+    # 2 месяца или менее
+    due = dates_df[days_until_actualization <= 60]
+    if due.empty:
+        return pd.DataFrame()
+    days_until_actualization = days_until_actualization[due.index]
+    
+    # Месяцы и дни до срока (или после него, если просрочено)
+    overdue = days_until_actualization < 0
+    abs_days = days_until_actualization.abs()
+    months = (abs_days // 30).astype(str)
+    days = (abs_days % 30).astype(str)
+    status = (
+        pd.Series(np.where(overdue, "🔴 Просрочено ", "🟢 Осталось "), index=due.index)
+        + months + " месяцев, " + days + " дней"
+    )
     
-    return completion_rate, published_rate
+    return pd.DataFrame({
+        'Номер формы': due['Номер формы'],
+        'Наименование отчета': due['Наименование отчета'],
+        'Владелец отчета ССП': due['Владелец отчета ССП'],
+        'Дата последней публикации': pd.to_datetime(due['pub_date']).dt.strftime('%d.%m.%Y'),
+        'Дата актуализации': actualization_dates[due.index].dt.strftime('%d.%m.%Y'),
+        'Статус актуализации': status
+    }).reset_index(drop=True)
 
 def get_reports_needing_confirmation(df):
     """Отчеты, требующие подтверждения актуальности"""
     if df is None or df.empty:
         return pd.DataFrame()
     
-    from datetime import datetime, timedelta
-    import pandas as pd
-    
-    result_data = []
-    current_date = datetime.now()
-    
-    for _, row in df.iterrows():
-        last_publication = row.get('Дата последней публикации отчета')
-        if pd.notna(last_publication):
-            try:
-                if isinstance(last_publication, str):
-                    pub_date = pd.to_datetime(last_publication)
-                else:
-                    pub_date = last_publication
-                
-                actualization_date = pub_date + timedelta(days=365)  # +1 год
-                days_until_actualization = (actualization_date - current_date).days
-                
-                if days_until_actualization <= 60:  # 2 месяца или менее
-                    # Форматируем дату в дд.мм.гггг
-                    pub_date_formatted = pub_date.strftime('%d.%m.%Y')
-                    actualization_date_formatted = actualization_date.strftime('%d.%m.%Y')
-                    
-                    # Рассчитываем месяцы и дни
-                    if days_until_actualization < 0:
-                        # Просрочено
-                        abs_days = abs(days_until_actualization)
-                        months = abs_days // 30
-                        days = abs_days % 30
-                        status_text = f"Просрочено {months} месяцев, {days} дней"
-                        status_color = "🔴"
-                    else:
-                        # Не просрочено
-                        months = days_until_actualization // 30
-                        days = days_until_actualization % 30
-                        status_text = f"Осталось {months} месяцев, {days} дней"
-                        status_color = "🟢"
-                    
-                    result_data.append({
-                        'Номер формы': row.get('Номер формы', ''),
-                        'Наименование отчета': row.get('Наименование отчета', ''),
-                        'Владелец отчета ССП': row.get('Владелец отчета ССП', ''),
-                        'Дата последней публикации': pub_date_formatted,
-                        'Дата актуализации': actualization_date_formatted,
-                        'Статус актуализации': f"{status_color} {status_text}"
-                    })
-            except:
-                continue
-    
-    return pd.DataFrame(result_data)
+    return format_confirmation_reports(get_actualization_dates(df), datetime.now())
 
 def get_reports_needing_update(df):
     """Отчеты, требующие актуализации"""
     if df is None or df.empty:
         return pd.DataFrame()
     
-    result_data = []
-    
-    for _, row in df.iterrows():
-        needs_update = False
-        actions = []
-        comments = []
-        
-        # Проверка статуса
-        status = row.get('Этап отчета', '')
-        if status != 'Опубликован':
-            needs_update = True
-            actions.append("Необходимо довести отчет до публикации")
-        
-        # Проверка незаполненных полей
-        empty_fields = []
-        for col in df.columns:
-            # Исключения
-            participation_value = row.get('Участие в формировании РФ', '')
-            if col == 'ССП, в функциональном подчинении которого, находятся сотрудники РФ' and str(participation_value).lower() == 'нет':
-                continue
-            frequency_value = row.get('Частота отчета', '')
-            if col == 'Частота отчета (ручной ввод)' and str(frequency_value).lower() != 'ручной ввод':
-                continue
-            
-            if pd.isna(row[col]) or str(row[col]).strip() == '':
-                empty_fields.append(col)
-        
-        if empty_fields:
-            needs_update = True
-            if status == 'Опубликован':
-                actions.append("Создать запрос на актуализацию")
-            comments.append(f"Заполнить поля ({'; '.join(empty_fields)})")
-        
-        # Проверка шаблона
-        template_value = row.get('Шаблон отчета', '')
-        if str(template_value).lower() == 'нет':
-            needs_update = True
-            comments.append("Добавить шаблон")
-        
-        # Проверка атрибутов
-        attributes_value = row.get('Атрибуты описаны', '')
-        if str(attributes_value).lower() == 'нет':
-            needs_update = True
-            comments.append("Описать атрибуты")
-        
-        if needs_update:
-            result_data.append({
-                'Номер формы': row.get('Номер формы', ''),
-                'Наименование отчета': row.get('Наименование отчета', ''),
-                'Этап отчета': status,
-                'Владелец отчета ССП': row.get('Владелец отчета ССП', ''),
-                'Необходимые действия': '; '.join(actions),
-                'Доп. комментарии': '; '.join(comments)
-            })
-    
-    return pd.DataFrame(result_data)
+    return completeness_rules.evaluate(df).update_recommendations()
+
+def build_dashboard_artifacts(df):
+    """
+    Расчет артефактов дашборда по реестру (общие и по владельцам)
+    
+    Срок до актуализации зависит от текущей даты, поэтому сохраняются только
+    даты публикации и актуализации, а статус считается при чтении.
+    
+    Returns:
+        dict: kpi, confirmation (даты актуализации), update (рекомендации),
+            breakdown (число отчетов по этапам и типам формирования)
+    """
+    owner_col = 'Владелец отчета ССП'
+    owners = df[owner_col] if owner_col in df.columns else pd.Series(np.nan, index=df.index)
+    
+    # Правила проверяются один раз, показатели всех владельцев — одна группировка
+    report = completeness_rules.evaluate(df)
+    kpi = pd.concat([
+        report.rates_by(pd.Series('Все', index=df.index)),
+        report.rates_by(owners)
+    ])
+    kpi = kpi.rename_axis('owner').reset_index()
+    
+    return {
+        'kpi': kpi,
+        'confirmation': get_actualization_dates(df),
+        'update': report.update_recommendations(),
+        'breakdown': build_stage_type_breakdown(df, owners)
+    }
+
+def build_stage_type_breakdown(df, owners):
+    """
+    Число отчетов по этапу и типу формирования для каждого владельца (и для «Все»)
+    
+    Returns:
+        pandas.DataFrame: owner, Этап отчета, Тип формирования отчета, Отчетов
+    """
+    not_set = "(не указан)"
+    dimensions = {}
+    for col in ['Этап отчета', 'Тип формирования отчета']:
+        values = df[col] if col in df.columns else pd.Series(np.nan, index=df.index)
+        dimensions[col] = values.astype(object).where(values.notna(), not_set).astype(str)
+    
+    counts = pd.DataFrame(dimensions).assign(owner=owners).groupby(
+        ['owner', 'Этап отчета', 'Тип формирования отчета']
+    ).size()
+    totals = pd.DataFrame(dimensions).groupby(['Этап отчета', 'Тип формирования отчета']).size()
+    totals = pd.concat({'Все': totals}, names=['owner'])
+    
+    return pd.concat([totals, counts]).rename('Отчетов').reset_index()
+
+def build_owner_cube(artifacts):
+    """
+    Показатели и рекомендации, разложенные по владельцам отчета ССП
+    
+    Таблицы артефактов делятся по владельцам один раз при загрузке, поэтому
+    переключение владельца на дашборде — поиск в словаре.
+    
+    Returns:
+        dict: владелец -> {kpi, confirmation, update, breakdown}
+    """
+    def split(table, owner_col='Владелец отчета ССП'):
+        if table.empty or owner_col not in table.columns:
+            return {}
+        return {owner: part.reset_index(drop=True) for owner, part in table.groupby(owner_col, sort=False)}
+    
+    confirmation = split(artifacts['confirmation'])
+    update = split(artifacts['update'])
+    breakdown = split(artifacts['breakdown'], 'owner')
+    
+    cube = {}
+    for kpi in artifacts['kpi'].to_dict('records'):
+        owner = kpi['owner']
+        cube[owner] = {
+            'kpi': kpi,
+            'confirmation': artifacts['confirmation'] if owner == 'Все'
+                            else confirmation.get(owner, artifacts['confirmation'].iloc[0:0]),
+            'update': artifacts['update'] if owner == 'Все'
+                      else update.get(owner, artifacts['update'].iloc[0:0]),
+            'breakdown': breakdown.get(owner, artifacts['breakdown'].iloc[0:0])
+        }
+    return cube
+
+def save_dashboard_artifacts(artifacts, version):
+    """Сохранение артефактов дашборда вместе с версией исходных данных"""
+    data_store.write(DASHBOARD_KPI_TABLE, artifacts['kpi'])
+    data_store.write(DASHBOARD_CONFIRMATION_TABLE, artifacts['confirmation'])
+    data_store.write(DASHBOARD_UPDATE_TABLE, artifacts['update'])
+    data_store.write(DASHBOARD_BREAKDOWN_TABLE, artifacts['breakdown'])
+    with open(DASHBOARD_ARTIFACTS_META_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'source_version': list(version), 'built_at': datetime.now().isoformat()}, f)
+
+def load_or_build_dashboard_artifacts():
+    """Чтение сохраненных артефактов; при изменении реестра — пересчет и сохранение"""
+    version = dataset_cache.version([REPORTS_DATA_FILE, REPORTS_JOURNAL_FILE])
+    
+    if DASHBOARD_ARTIFACTS_META_FILE.exists():
+        with open(DASHBOARD_ARTIFACTS_META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if tuple(meta.get('source_version', [])) == version:
+            artifacts = {
+                'kpi': data_store.read(DASHBOARD_KPI_TABLE),
+                'confirmation': data_store.read(DASHBOARD_CONFIRMATION_TABLE),
+                'update': data_store.read(DASHBOARD_UPDATE_TABLE),
+                'breakdown': data_store.read(DASHBOARD_BREAKDOWN_TABLE)
+            }
+            if all(value is not None for value in artifacts.values()):
+                artifacts['owners'] = build_owner_cube(artifacts)
+                return artifacts
+    
+    df, _ = load_reports_data()
+    if df is None:
+        return None
+    
+    artifacts = build_dashboard_artifacts(df)
+    save_dashboard_artifacts(artifacts, version)
+    artifacts['owners'] = build_owner_cube(artifacts)
+    return artifacts
+
+def get_dashboard_artifacts():
+    """Артефакты дашборда из общего кэша процесса (None, если реестр не загружен)"""
+    try:
+        artifacts, _ = dataset_cache.get(
+            "dashboard_artifacts",
+            [REPORTS_DATA_FILE, REPORTS_JOURNAL_FILE],
+            load_or_build_dashboard_artifacts
+        )
+        return artifacts
+    except Exception as e:
+        st.error(f"Ошибка при расчете показателей дашборда: {str(e)}")
+        return None
 
 # Заголовок приложения
 st.markdown('<div class="main-header">📊 Система управления отчетами</div>', unsafe_allow_html=True)
@@ -980,6 +1332,18 @@ def show_attributes():
         st.session_state.attr_df = None
     if 'attr_uploaded_file_name' not in st.session_state:
         st.session_state.attr_uploaded_file_name = ""
+    if 'attr_sample_cache' not in st.session_state:
+        st.session_state.attr_sample_cache = {}
+    
+    mode = st.radio(
+        "Режим",
+        options=["📄 Один файл", "🗂️ Пакет файлов"],
+        horizontal=True,
+        key="attributes_mode"
+    )
+    if mode == "🗂️ Пакет файлов":
+        show_attributes_batch()
+        return
     
     # Основной интерфейс
     col1, col2 = st.columns([1, 1])
@@ -988,8 +1352,8 @@ def show_attributes():
         st.header("📁 Загрузка файла")
         uploaded_file = st.file_uploader(
             "Выберите Excel или CSV файл",
-            type=['xlsx', 'xls', 'csv'],
-            help="Поддерживаются форматы: Excel (.xlsx, .xls) и CSV (.csv)",
+            type=['xlsx', 'xlsm', 'xls', 'xlsb', 'ods', 'csv'],
+            help="Поддерживаются форматы: Excel (.xlsx, .xlsm, .xls, .xlsb), OpenDocument (.ods) и CSV (.csv)",
             key="attributes_file_uploader"
         )
     
@@ -1009,15 +1373,35 @@ def show_attributes():
             key="attributes_report_type"
         )
     
+        full_scan = st.checkbox(
+            "Анализировать все строки файла",
+            help=f"По умолчанию типы и профиль столбцов определяются по первым {HEADER_SAMPLE_ROWS} строкам",
+            key="attributes_full_scan"
+        )
+        sample_rows = None if full_scan else HEADER_SAMPLE_ROWS
+        
+        type_sampling = st.checkbox(
+            "Определять типы длинных столбцов по выборке",
+            help=f"Тип столбца определяется по выборке из {DEFAULT_SAMPLE_SIZE} значений; столбцы, где доля "
+                 "дат или чисел близка к порогу, проверяются целиком. Ускоряет анализ всех строк больших файлов",
+            key="attributes_type_sampling"
+        )
+        type_sample_size = DEFAULT_SAMPLE_SIZE if type_sampling else None
+    
     if uploaded_file is not None:
         st.session_state.attr_uploaded_file_name = uploaded_file.name
         
         # Создаем трансформер
-        transformer = ExcelTransformer(report_number=report_number)
+        transformer = ExcelTransformer(report_number=report_number, type_sample_size=type_sample_size)
         
         try:
-            # Загружаем данные
-            df = transformer.load_from_uploaded_file(uploaded_file)
+            # Читаем заголовок и первые строки один раз на файл (перезапуски страницы берут их из сессии)
+            file_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+            cached = st.session_state.attr_sample_cache.get((file_hash, sample_rows))
+            if cached is None:
+                cached = transformer.load_header_sample(uploaded_file, sample_rows)
+                st.session_state.attr_sample_cache = {(file_hash, sample_rows): cached}
+            df, total_rows = cached
             
             # Сохраняем в session state
             st.session_state.attr_transformer = transformer
@@ -1029,23 +1413,34 @@ def show_attributes():
             # Показываем базовую информацию о файле
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Количество строк", len(df))
+                st.metric("Количество строк", total_rows if total_rows is not None else len(df))
             with col2:
                 st.metric("Количество столбцов", len(df.columns))
             with col3:
                 st.metric("Номер отчета", report_number)
             
+            # Файл прочитан не целиком: типы и профиль описывают только его начало
+            if sample_rows is not None and len(df) >= sample_rows and total_rows != len(df):
+                st.info(
+                    f"ℹ️ Типы и профиль столбцов определяются по первым {len(df)} строкам файла"
+                    + (f" из {total_rows}" if total_rows is not None else "")
+                    + ". Чтобы учесть все строки, отметьте «Анализировать все строки файла»."
+                )
+            
             # Кнопка для выгрузки атрибутного состава
             st.markdown("---")
+            include_profile = st.checkbox(
+                "Добавить лист с профилем столбцов",
+                help="Доля пустых значений, минимум и максимум, длина значений и пример по каждому столбцу",
+                key="attributes_include_profile"
+            )
             if st.button("🔄 Выгрузить атрибутный состав", type="primary", use_container_width=True, key="generate_attributes"):
                 with st.spinner("Преобразование данных..."):
-                    # Сброс указателя файла и преобразование
-                    uploaded_file.seek(0)
-                    df_fresh = transformer.load_from_uploaded_file(uploaded_file)
-                    metadata_df = transformer.transform_to_metadata(df_fresh, report_type)
-                    
-                    # Создаем Excel файл для скачивания
-                    excel_data = transformer.create_excel_download(metadata_df)
+                    # Типы определяются по уже прочитанным первым строкам файла;
+                    # повторная выгрузка того же файла с теми же параметрами берется из кэша
+                    metadata_df, excel_data = build_attribute_workbook(
+                        transformer, file_hash, report_type, lambda: df, include_profile, sample_rows
+                    )
                     
                     # Генерируем имя файла
                     filename = f"{report_number}_атрибуты.xlsx"
@@ -1075,10 +1470,111 @@ def show_attributes():
                     )
                     
                     st.info("💡 **Совет**: Файл необходимо доработать, заполнив обязательные колонки. А также проверить предзаполненные значения")
+                    
+                    # Типы, определенные по выборке, стоит проверить вручную
+                    uncertain = metadata_df[metadata_df['type_confidence'] < 0.99]
+                    if not uncertain.empty:
+                        with st.expander(f"🔍 Типы, определенные по выборке с уверенностью ниже 99% ({len(uncertain)})"):
+                            st.caption(f"Уверенность рассчитана для прочитанных строк файла ({len(df)}), а не для всего файла")
+                            st.dataframe(
+                                uncertain[['name', 'base_type_report_field', 'type_confidence']].rename(columns={
+                                    'name': 'Наименование атрибута',
+                                    'base_type_report_field': 'Базовый тип атрибута',
+                                    'type_confidence': 'Уверенность'
+                                }).style.format({'Уверенность': '{:.1%}'}),
+                                use_container_width=True,
+                                hide_index=True
+                            )
         
         except Exception as e:
             st.error(f"❌ Ошибка при обработке файла: {str(e)}")
 
+def show_attributes_batch():
+    """Пакетное формирование атрибутов: много шаблонов — один zip-архив"""
+    uploaded_files = st.file_uploader(
+        "Выберите файлы шаблонов или zip-архив",
+        type=['xlsx', 'xlsm', 'xls', 'xlsb', 'ods', 'csv', 'zip'],
+        accept_multiple_files=True,
+        help="Для каждого файла укажите номер и тип отчета в таблице ниже",
+        key="attributes_batch_uploader"
+    )
+    if not uploaded_files:
+        return
+    
+    try:
+        sources = read_attribute_sources(uploaded_files)
+    except Exception as e:
+        st.error(f"❌ Ошибка при чтении архива: {str(e)}")
+        return
+    if not sources:
+        st.warning("⚠️ В загруженных файлах нет шаблонов (xlsx, xls, csv)")
+        return
+    
+    # Сопоставление файлов с номерами отчетов (по умолчанию — имя файла)
+    mapping_df = st.data_editor(
+        pd.DataFrame({
+            'Файл': [name for name, _ in sources],
+            'Номер отчета': [Path(name).stem for name, _ in sources],
+            'Тип отчета': ["Ручной"] * len(sources)
+        }),
+        column_config={
+            'Файл': st.column_config.TextColumn(disabled=True),
+            'Тип отчета': st.column_config.SelectboxColumn(
+                options=["Ручной", "Полуавтоматический", "Автоматический", "ИЛА"], required=True
+            )
+        },
+        hide_index=True,
+        use_container_width=True,
+        key="attributes_batch_mapping"
+    )
+    
+    include_profile = st.checkbox(
+        "Добавить лист с профилем столбцов",
+        help="Доля пустых значений, минимум и максимум, длина значений и пример по каждому столбцу",
+        key="attributes_batch_include_profile"
+    )
+    full_scan = st.checkbox(
+        "Анализировать все строки файлов",
+        help=f"По умолчанию типы и профиль столбцов определяются по первым {HEADER_SAMPLE_ROWS} строкам каждого файла",
+        key="attributes_batch_full_scan"
+    )
+    if not full_scan:
+        st.caption(f"ℹ️ Типы и профиль столбцов определяются по первым {HEADER_SAMPLE_ROWS} строкам каждого файла")
+    type_sampling = st.checkbox(
+        "Определять типы длинных столбцов по выборке",
+        help=f"Тип столбца определяется по выборке из {DEFAULT_SAMPLE_SIZE} значений; столбцы, где доля "
+             "дат или чисел близка к порогу, проверяются целиком. Ускоряет анализ всех строк больших файлов",
+        key="attributes_batch_type_sampling"
+    )
+    if st.button("🔄 Выгрузить атрибутные составы", type="primary", use_container_width=True, key="generate_attributes_batch"):
+        jobs = [
+            (name, data, str(row['Номер отчета']).strip() or Path(name).stem, row['Тип отчета'])
+            for (name, data), (_, row) in zip(sources, mapping_df.iterrows())
+        ]
+        progress = st.progress(0.0, text="Преобразование данных...")
+        zip_data, summary_df = build_attributes_zip(
+            jobs, on_progress=lambda done, total: progress.progress(done / total, text=f"Обработано файлов: {done} из {total}"),
+            include_profile=include_profile, sample_rows=None if full_scan else HEADER_SAMPLE_ROWS,
+            type_sample_size=DEFAULT_SAMPLE_SIZE if type_sampling else None
+        )
+        
+        ok_count = int((summary_df['Статус'] == 'Готово').sum())
+        if ok_count == len(summary_df):
+            st.success(f"✅ Атрибутные составы созданы: {ok_count}")
+        else:
+            st.warning(f"⚠️ Создано {ok_count} из {len(summary_df)}, ошибки — в сводке")
+        
+        st.dataframe(summary_df, use_container_width=True, hide_index=True)
+        st.download_button(
+            label="📥 Скачать архив атрибутных составов",
+            data=zip_data,
+            file_name=f"атрибуты_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            mime="application/zip",
+            type="primary",
+            use_container_width=True,
+            key="download_attributes_batch"
+        )
+
 def show_dashboard():
     st.markdown('<div class="page-header">📈 Дашборд по отчетам</div>', unsafe_allow_html=True)
     
@@ -1100,7 +1596,7 @@ def show_dashboard():
         return
     
     # Показываем информацию о данных
-    df = st.session_state.reports_data.copy()
+    df = st.session_state.reports_data
     
     # Информационная панель
     #with st.expander("📋 Информация о данных", expanded=False):
@@ -1115,22 +1611,38 @@ def show_dashboard():
     #            file_time = datetime.fromtimestamp(REPORTS_DATA_FILE.stat().st_mtime)
     #            st.metric("Обновлено", file_time.strftime('%d.%m.%Y'))
 
+    # Показатели и рекомендации берем из предрасчитанного разреза по владельцам,
+    # при его отсутствии считаем по отфильтрованным данным
+    artifacts = get_dashboard_artifacts()
+    owner_cube = artifacts['owners'] if artifacts is not None else None
+    
     # Фильтр по владельцу ССП
     st.markdown("## 🎯 Фильтры")
-    if 'Владелец отчета ССП' in df.columns:
+    if owner_cube is not None:
+        owners = ['Все'] + sorted(owner for owner in owner_cube if owner != 'Все')
+        selected_owner = st.selectbox("Выберите владельца отчета ССП", owners, key="dashboard_owner_filter")
+    elif 'Владелец отчета ССП' in df.columns:
         owners = ['Все'] + sorted(df['Владелец отчета ССП'].dropna().unique().tolist())
         selected_owner = st.selectbox("Выберите владельца отчета ССП", owners, key="dashboard_owner_filter")
     else:
         selected_owner = "Все"
     
     # Применяем фильтр
-    filtered_df = df.copy()
+    filtered_df = df
     if selected_owner != "Все":
         filtered_df = filtered_df[filtered_df['Владелец отчета ССП'] == selected_owner]
     
+    owner_metrics = owner_cube.get(selected_owner) if owner_cube is not None else None
+    
     # Основные метрики
     st.markdown("## 📊 Ключевые показатели")
-    completion_rate, published_rate = calculate_completion_percentage(filtered_df)
+    if owner_metrics is not None:
+        completion_rate = owner_metrics['kpi']['completion_rate']
+        published_rate = owner_metrics['kpi']['published_rate']
+        total_reports = int(owner_metrics['kpi']['total'])
+    else:
+        completion_rate, published_rate = calculate_completion_percentage(filtered_df)
+        total_reports = len(filtered_df)
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -1152,7 +1664,7 @@ def show_dashboard():
     with col3:
         st.metric(
             "Всего отчетов",
-            len(filtered_df),
+            total_reports,
             delta=None,
             help="Общее количество отчетов"
         )
@@ -1163,7 +1675,10 @@ def show_dashboard():
     
     # 1. Отчеты, требующие подтверждения актуальности
     st.markdown("### 🔔 Необходимо подтверждение актуальности отчетов")
-    confirmation_reports = get_reports_needing_confirmation(filtered_df)
+    if owner_metrics is not None:
+        confirmation_reports = format_confirmation_reports(owner_metrics['confirmation'], datetime.now())
+    else:
+        confirmation_reports = get_reports_needing_confirmation(filtered_df)
     
     if not confirmation_reports.empty:
         st.dataframe(
@@ -1184,7 +1699,10 @@ def show_dashboard():
     
     # 2. Отчеты, требующие актуализации
     st.markdown("### ⚠️ Требуется актуализация отчетов")
-    update_reports = get_reports_needing_update(filtered_df)
+    if owner_metrics is not None:
+        update_reports = owner_metrics['update']
+    else:
+        update_reports = get_reports_needing_update(filtered_df)
     
     if not update_reports.empty:
         st.dataframe(
@@ -1207,6 +1725,14 @@ def show_dashboard():
     st.markdown("---")
     st.markdown("## 📋 Детальная информация по отчетам")
     
+    if owner_metrics is not None and not owner_metrics['breakdown'].empty:
+        with st.expander("📊 Отчеты по этапам и типам формирования", expanded=False):
+            breakdown = owner_metrics['breakdown'].pivot_table(
+                index='Этап отчета', columns='Тип формирования отчета',
+                values='Отчетов', aggfunc='sum', fill_value=0
+            )
+            st.dataframe(breakdown, use_container_width=True)
+    
     # Дополнительные фильтры
     col1, col2 = st.columns(2)
     with col1:
@@ -1314,12 +1840,9 @@ def calculate_business_days(start_date, end_date):
     except Exception as e:
         return 0
 
-def process_request_data(df):
-    """Обработка данных согласно требованиям"""
-    
-    # Конвертируем даты
-    date_columns = ['created_at', 'ts_from', 'ts_to']
-    for col in date_columns:
+def convert_request_dates(df):
+    """Конвертация столбцов дат в выгрузке запросов (на месте)"""
+    for col in REQUESTS_DATE_COLUMNS:
         if col in df.columns:
             try:
                 df[col] = pd.to_datetime(df[col], format='%d.%m.%Y', errors='coerce')
@@ -1328,6 +1851,19 @@ def process_request_data(df):
                     df[col] = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
                 except:
                     df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+def process_request_data(df, on_progress=None):
+    """
+    Обработка данных согласно требованиям
+    
+    Args:
+        df (pandas.DataFrame): исходные данные о стадиях запросов
+        on_progress: необязательная функция (обработано, всего) для отчета о прогрессе
+    """
+    
+    # Конвертируем даты
+    convert_request_dates(df)
     
     # Сортируем по created_at от новых к старым
     df_sorted = df.sort_values('created_at', ascending=False)
@@ -1340,18 +1876,36 @@ def process_request_data(df):
         lambda x: x.loc[x['ts_from'].idxmax()] if x['ts_from'].notna().any() else x.iloc[-1]
     ).reset_index(drop=True)
     
+    return build_request_summary(unique_requests, latest_records, on_progress)
+
+def build_request_summary(unique_requests, latest_records, on_progress=None):
+    """
+    Итоговая таблица запросов
+    
+    Args:
+        unique_requests (pandas.DataFrame): самая новая строка каждого запроса (от новых к старым)
+        latest_records (pandas.DataFrame): строка с последним ts_from для каждого запроса
+        on_progress: необязательная функция (обработано, всего) для отчета о прогрессе
+    """
+    # ts_from последней записи по business_id
+    latest_ts_from = dict(zip(latest_records['business_id'], latest_records['ts_from']))
+    
     # Создаем итоговую таблицу
     result_data = []
+    total_requests = len(unique_requests)
     
-    for _, unique_row in unique_requests.iterrows():
+    for row_number, (_, unique_row) in enumerate(unique_requests.iterrows()):
+        if on_progress is not None and row_number % 1000 == 0:
+            on_progress(row_number, total_requests)
+        
         business_id = unique_row['business_id']
         
         # Находим соответствующую последнюю запись для расчета дней
-        latest_row = latest_records[latest_records['business_id'] == business_id].iloc[0]
+        ts_from = latest_ts_from[business_id]
         
         # Рассчитываем дни в работе (рабочие дни)
-        if pd.notna(latest_row['ts_from']):
-            days_in_work = calculate_business_days(latest_row['ts_from'], datetime.now())
+        if pd.notna(ts_from):
+            days_in_work = calculate_business_days(ts_from, datetime.now())
         else:
             days_in_work = 0
         
@@ -1363,7 +1917,7 @@ def process_request_data(df):
             'report_code': unique_row.get('report_code', ''),
             'report_name': unique_row.get('report_name', ''),
             'current_stage': unique_row.get('current_stage', ''),
-            'ts_from': latest_row['ts_from'].strftime('%d.%m.%Y') if pd.notna(latest_row['ts_from']) else '',
+            'ts_from': ts_from.strftime('%d.%m.%Y') if pd.notna(ts_from) else '',
             'analyst': unique_row.get('Analyst', ''),
             'request_owner': unique_row.get('request_owner', ''),
             'request_owner_ssp': unique_row.get('request_owner_ssp', '')
@@ -1371,6 +1925,59 @@ def process_request_data(df):
     
     return pd.DataFrame(result_data)
 
+# Ключ строки стадии запроса для дозагрузки
+REQUESTS_MERGE_KEY = ['business_id', 'ts_from', 'current_stage']
+
+def refresh_business_days(processed_df):
+    """Пересчет рабочих дней в работе на текущую дату (векторно, без праздников)"""
+    processed_df = processed_df.copy()
+    ts_from = pd.to_datetime(processed_df['ts_from'], format='%d.%m.%Y', errors='coerce')
+    valid = ts_from.notna().to_numpy()
+    
+    days = np.zeros(len(processed_df), dtype=int)
+    if valid.any():
+        # Как и calculate_business_days: будни от ts_from по сегодняшний день включительно
+        end_date = np.datetime64(datetime.now().date() + timedelta(days=1), 'D')
+        start_dates = ts_from[valid].to_numpy().astype('datetime64[D]')
+        days[valid] = np.clip(np.busday_count(start_dates, end_date), 0, None)
+    
+    processed_df['рабочих_дней_в_работе'] = days
+    return processed_df
+
+def merge_request_delta(history_df, delta_df, processed_df):
+    """
+    Дозагрузка новых и измененных строк стадий в сохраненную историю
+    
+    Строки объединяются по (business_id, ts_from, current_stage), при совпадении
+    остается строка из дозагрузки. Итоговая таблица пересчитывается только для
+    затронутых business_id, у остальных обновляются только дни в работе.
+    
+    Args:
+        history_df (pandas.DataFrame): сохраненные исходные данные
+        delta_df (pandas.DataFrame): новые или измененные строки
+        processed_df (pandas.DataFrame): сохраненная итоговая таблица
+        
+    Returns:
+        tuple: (объединенная история, итоговая таблица, количество затронутых запросов)
+    """
+    delta_df = convert_request_dates(delta_df.copy())
+    history_df = convert_request_dates(history_df.copy())
+    
+    merged_df = pd.concat([history_df, delta_df], ignore_index=True)
+    merged_df = merged_df.drop_duplicates(subset=REQUESTS_MERGE_KEY, keep='last').reset_index(drop=True)
+    
+    touched_ids = delta_df['business_id'].unique()
+    touched_processed = process_request_data(merged_df[merged_df['business_id'].isin(touched_ids)].copy())
+    untouched_processed = refresh_business_days(processed_df[~processed_df['business_id'].isin(touched_ids)])
+    
+    result_df = pd.concat([untouched_processed, touched_processed], ignore_index=True)
+    
+    # Сохраняем порядок полной обработки: от новых запросов к старым
+    created_at = pd.to_datetime(result_df['created_at'], format='%d.%m.%Y', errors='coerce')
+    result_df = result_df.iloc[created_at.argsort(kind='stable')[::-1]].reset_index(drop=True)
+    
+    return merged_df, result_df, len(touched_ids)
+
 def create_excel_download_requests(df):
     """Создание Excel файла для скачивания запросов"""
     output = io.BytesIO()
@@ -1398,14 +2005,189 @@ def create_excel_download_requests(df):
     output.seek(0)
     return output.getvalue()
 
+def read_uploaded_requests(file_bytes, file_name):
+    """Чтение и очистка загруженной выгрузки запросов"""
+    file_extension = file_name.split('.')[-1].lower()
+    
+    if file_extension == 'csv':
+        df = read_csv(file_bytes)
+    elif f".{file_extension}" in EXCEL_EXTENSIONS:
+        df = read_excel(file_bytes, file_name)
+    else:
+        raise ValueError("Неподдерживаемый формат файла!")
+    
+    # Удаляем полностью пустые строки
+    df = df.dropna(how='all')
+    
+    # Удаляем строки где business_id пустой
+    if 'business_id' not in df.columns:
+        raise ValueError("В файле отсутствует столбец 'business_id'")
+    return df.dropna(subset=['business_id'])
+
+def ingest_requests_file(job, file_bytes, file_name, merge=False):
+    """
+    Фоновая задача: чтение, обработка и сохранение выгрузки запросов
+    
+    Сохраненная история для дозагрузки читается внутри задачи, а чтение,
+    объединение и запись выполняются под блокировкой таблиц запросов:
+    одновременные загрузки не перезаписывают строки друг друга.
+    
+    Args:
+        job: задача (прогресс и отмена)
+        file_bytes (bytes): содержимое загруженного файла
+        file_name (str): имя загруженного файла
+        merge (bool): режим дозагрузки (объединение с сохраненной историей)
+        
+    Returns:
+        dict: обработанные данные, количество записей и пересчитанных запросов
+            (полная история в результат не входит: она сохранена в хранилище)
+    """
+    job.update(0.05, "Чтение файла")
+    streaming = (
+        not merge
+        and file_name.lower().endswith('.csv')
+        and len(file_bytes) >= REQUESTS_STREAMING_MIN_BYTES
+    )
+    
+    touched_count = None
+    read_timing = ''
+    if streaming:
+        # Большая история: CSV сворачивается по фрагментам, а сами фрагменты
+        # сразу пишутся в хранилище — файл целиком в pandas не разбирается
+        buffer = io.BytesIO(file_bytes)
+        history_writer = data_store.chunked_writer(REQUESTS_TABLE, date_columns=REQUESTS_DATE_COLUMNS)
+        try:
+            aggregator = aggregate_request_history_csv(
+                buffer, prepare_chunk=convert_request_dates, on_rows=history_writer.write,
+                on_chunk=lambda rows: job.update(0.05 + 0.6 * buffer.tell() / len(file_bytes), f"Прочитано {rows} записей")
+            )
+            unique_requests, latest_records = aggregator.result()
+            
+            job.update(0.7, f"Обработка {aggregator.rows} записей")
+            processed_data = build_request_summary(
+                unique_requests, latest_records,
+                on_progress=lambda done, total: job.update(0.7 + 0.15 * done / max(total, 1))
+            )
+            
+            job.update(0.85, "Сохранение")
+            with ingestion_jobs.resource_lock(REQUESTS_TABLE):
+                try:
+                    history_writer.commit()
+                    data_store.write(REQUESTS_PROCESSED_TABLE, processed_data)
+                finally:
+                    dataset_cache.invalidate(REQUESTS_TABLE)
+                    dataset_cache.invalidate(REQUESTS_PROCESSED_TABLE)
+                
+                # Версия истории собирается из сохраненной таблицы порциями:
+                # полная история целиком в память не читается
+                snapshot_store.save_batches(
+                    "requests", data_store.read_batches(REQUESTS_TABLE), file_name,
+                    date_columns=REQUESTS_DATE_COLUMNS
+                )
+        finally:
+            history_writer.discard()
+        
+        rows_count = aggregator.rows
+    else:
+        df = read_uploaded_requests(file_bytes, file_name)
+        rows_count = len(df)
+        read_timing = format_read_timing(df)
+        
+        job.update(0.3, f"Обработка {rows_count} записей")
+        if not merge:
+            processed_data = process_request_data(
+                df, on_progress=lambda done, total: job.update(0.3 + 0.5 * done / max(total, 1))
+            )
+        
+        with ingestion_jobs.resource_lock(REQUESTS_TABLE):
+            if merge:
+                # История берется из хранилища, а не из сессии на момент запуска:
+                # за это время ее могла изменить другая загрузка
+                (history_df, history_processed), _ = read_shared_requests_data()
+                if history_df is None or history_processed is None:
+                    raise ValueError("Нет сохраненной истории для дозагрузки")
+                df, processed_data, touched_count = merge_request_delta(history_df, df, history_processed)
+            
+            # После начала записи задача уже не отменяется, чтобы не оставить данные наполовину
+            job.update(0.85, "Сохранение")
+            write_requests_data(df, processed_data)
+            snapshot_store.save("requests", df, file_name, date_columns=REQUESTS_DATE_COLUMNS)
+    
+    return {
+        'processed': processed_data,
+        'rows': rows_count,
+        'touched': touched_count,
+        'streaming': streaming,
+        'read_timing': read_timing
+    }
+
+def apply_request_upload_job():
+    """Перенос результата завершенной фоновой задачи в сессию"""
+    upload_state = st.session_state.get('request_upload_job')
+    if upload_state is None or upload_state['applied']:
+        return
+    
+    job = ingestion_jobs.get(upload_state['id'])
+    if job is None:
+        # Результат того же файла уже забрала другая сессия: данные есть в файлах
+        state = ingestion_jobs.saved_state(upload_state['id'])
+        upload_state['applied'] = True
+        if state is not None and state['status'] == JOB_DONE:
+            st.session_state.request_processed_data = load_requests_data()
+            upload_state['messages'] = [('success', "✅ Данные успешно обработаны и сохранены!")]
+        else:
+            error = state['error'] if state is not None else "задача не найдена"
+            upload_state['messages'] = [('error', f"❌ Ошибка при обработке данных: {error}")]
+            upload_state['key'] = None
+        return
+    if not job.finished:
+        return
+    
+    upload_state['applied'] = True
+    if job.status == JOB_DONE:
+        result = job.result
+        st.session_state.request_processed_data = result['processed']
+        upload_state['messages'] = [('success', f"✅ Файл успешно загружен! Найдено {result['rows']} записей.")]
+        if result['read_timing']:
+            upload_state['messages'].append(('caption', result['read_timing']))
+        if result['touched'] is not None:
+            upload_state['messages'].append(('info', f"➕ Дозагрузка: пересчитано запросов — {result['touched']}"))
+        if result['streaming']:
+            upload_state['messages'].append((
+                'info',
+                f"📦 Большой файл обработан потоково: история сохранена по частям ({result['rows']} строк)"
+            ))
+        upload_state['messages'].append(('success', "✅ Данные успешно обработаны и сохранены!"))
+    elif job.status == JOB_CANCELLED:
+        upload_state['messages'] = [('warning', "⚠️ Обработка файла отменена")]
+        upload_state['key'] = None
+    else:
+        upload_state['messages'] = [('error', f"❌ Ошибка при обработке данных: {job.error}")]
+        upload_state['key'] = None
+    ingestion_jobs.forget(job.id)
+
+@st.fragment(run_every=1)
+def show_request_upload_progress():
+    """Прогресс фоновой обработки (обновляется без перезапуска всей страницы)"""
+    upload_state = st.session_state.get('request_upload_job')
+    if upload_state is None or upload_state['applied']:
+        return
+    
+    job = ingestion_jobs.get(upload_state['id'])
+    if job is None or job.finished:
+        # Результат переносится в сессию при полном перезапуске страницы
+        st.rerun()
+    
+    st.progress(job.progress, text=f"⏳ {job.name}: {job.message}")
+    if st.button("⏹️ Отменить обработку", key="request_upload_cancel"):
+        ingestion_jobs.cancel(job.id)
+
 def display_request_analysis():
     """Отображение анализатора запросов"""
     
     # Инициализация session state для анализатора (если не инициализированы)
     if 'request_processed_data' not in st.session_state:
         st.session_state.request_processed_data = None
-    if 'request_original_data' not in st.session_state:
-        st.session_state.request_original_data = None
     
     # Показываем статус загруженных данных
     if st.session_state.request_processed_data is not None:
@@ -1431,61 +2213,62 @@ def display_request_analysis():
     
     uploaded_file = st.file_uploader(
         "Выберите файл с данными о запросах",
-        type=['csv', 'xlsx'],
-        help="Поддерживаются файлы в форматах CSV, XLSX. При загрузке нового файла предыдущие данные будут заменены.",
+        type=['csv', 'xlsx', 'xlsm', 'xls', 'xlsb', 'ods'],
+        help="Поддерживаются файлы в форматах CSV, XLSX, XLSM, XLS, XLSB, ODS. При загрузке нового файла предыдущие данные будут заменены (кроме режима дозагрузки).",
         key="request_analysis_uploader"
     )
     
-    # Автоматическая загрузка и анализ файла
+    # Режим дозагрузки доступен, если уже есть сохраненная история
+    has_history = (
+        st.session_state.request_processed_data is not None
+        and data_store.exists(REQUESTS_TABLE)
+    )
+    merge_mode = st.checkbox(
+        "➕ Режим дозагрузки (merge delta)",
+        value=False,
+        disabled=not has_history,
+        help="Файл содержит только новые или измененные строки стадий: они объединяются с сохраненной "
+             "историей по (business_id, ts_from, current_stage), пересчитываются только затронутые запросы",
+        key="request_merge_mode"
+    )
+    
+    # Автоматическая загрузка и анализ файла в фоновой задаче
     if uploaded_file is not None:
-        try:
-            # Определяем тип файла и читаем соответствующим образом
-            file_extension = uploaded_file.name.split('.')[-1].lower()
-            
-            if file_extension == 'csv':
-                df = pd.read_csv(uploaded_file, encoding='utf-8')
-            elif file_extension == 'xlsx':
-                df = pd.read_excel(uploaded_file)
-            else:
-                st.error("❌ Неподдерживаемый формат файла!")
-                return
-            
-            # Удаляем полностью пустые строки
-            df = df.dropna(how='all')
-            
-            # Удаляем строки где business_id пустой
-            if 'business_id' in df.columns:
-                df = df.dropna(subset=['business_id'])
-            else:
-                st.error("❌ В файле отсутствует столбец 'business_id'")
-                return
-            
-            st.session_state.request_original_data = df
-            st.success(f"✅ Файл успешно загружен! Найдено {len(df)} записей.")
-            
-            # Автоматически обрабатываем данные
-            try:
-                processed_data = process_request_data(df)
-                st.session_state.request_processed_data = processed_data
-                
-                # Сохраняем в постоянные файлы
-                if save_requests_data(df, processed_data):
-                    st.success("✅ Данные успешно обработаны и сохранены!")
-                else:
-                    st.error("❌ Ошибка при сохранении данных")
-                
-            except Exception as e:
-                st.error(f"❌ Ошибка при обработке данных: {str(e)}")
-            
-        except Exception as e:
-            st.error(f"❌ Ошибка при загрузке файла: {str(e)}")
+        file_bytes = uploaded_file.getvalue()
+        use_merge = merge_mode and has_history
+        upload_key = (hashlib.sha256(file_bytes).hexdigest(), use_merge)
+        
+        # Сначала забираем результат завершенной задачи (в том числе ошибку)
+        apply_request_upload_job()
+        
+        # Перезапуск страницы не запускает обработку того же файла повторно.
+        # После ошибки или отмены ключ сброшен: тот же файл обрабатывается
+        # заново по кнопке или при повторной загрузке, но не при каждом перезапуске
+        upload_state = st.session_state.get('request_upload_job')
+        failed = upload_state is not None and upload_state['key'] is None
+        retry = failed and st.button("🔁 Повторить обработку", key="request_upload_retry")
+        if (upload_state is None or retry
+                or (upload_state['key'] != upload_key
+                    and not (failed and upload_state['file_id'] == uploaded_file.file_id))):
+            job = ingestion_jobs.submit(
+                "requests", uploaded_file.name, ingest_requests_file,
+                file_bytes, uploaded_file.name, use_merge,
+                dedup_key=upload_key
+            )
+            st.session_state.request_upload_job = {
+                'key': upload_key, 'file_id': uploaded_file.file_id, 'id': job.id, 'applied': False, 'messages': []
+            }
+        
+        show_request_upload_progress()
+        
+        for level, message in st.session_state.request_upload_job['messages']:
+            getattr(st, level)(message)
     
     # Кнопка для принудительной загрузки из файлов
     if st.session_state.request_processed_data is None:
         if st.button("🔄 Попробовать загрузить данные из сохраненных файлов", key="req_load_from_files"):
-            original_df, processed_df = load_requests_data()
+            processed_df = load_requests_data()
             if processed_df is not None:
-                st.session_state.request_original_data = original_df
                 st.session_state.request_processed_data = processed_df
                 st.success("✅ Данные успешно загружены из файлов!")
                 st.rerun()
@@ -1517,15 +2300,15 @@ def display_request_analysis():
             if st.button("🔄 Очистить данные анализатора", key="req_clear_data", help="Удалит все данные анализатора запросов"):
                 if st.session_state.get('confirm_clear_requests', False):
                     # Очищаем session state
-                    st.session_state.request_original_data = None
                     st.session_state.request_processed_data = None
                     
                     # Удаляем файлы
                     try:
-                        if REQUESTS_DATA_FILE.exists():
-                            REQUESTS_DATA_FILE.unlink()
-                        if REQUESTS_PROCESSED_FILE.exists():
-                            REQUESTS_PROCESSED_FILE.unlink()
+                        with ingestion_jobs.resource_lock(REQUESTS_TABLE):
+                            data_store.delete(REQUESTS_TABLE)
+                            data_store.delete(REQUESTS_PROCESSED_TABLE)
+                            dataset_cache.invalidate(REQUESTS_TABLE)
+                            dataset_cache.invalidate(REQUESTS_PROCESSED_TABLE)
                         
                         st.success("✅ Данные анализатора очищены!")
                         st.session_state.confirm_clear_requests = False
@@ -1537,6 +2320,86 @@ def display_request_analysis():
                     st.session_state.confirm_clear_requests = True
                     st.warning("⚠️ Нажмите еще раз для подтверждения очистки")
                     st.rerun()
+    
+    # Полная история читается с диска только для сравнения версий и в кэше не остается
+    show_upload_history(
+        "requests", dataset_cache.file_version(REQUESTS_DATA_FILE),
+        lambda: data_store.read(REQUESTS_TABLE), rollback_requests_data, REQUESTS_DATE_COLUMNS
+    )
+
+def rollback_requests_data(df):
+    """Восстановление данных анализатора из версии истории загрузок"""
+    processed_df = process_request_data(df.copy())
+    if save_requests_data(df, processed_df):
+        st.session_state.request_processed_data = processed_df
+        return True
+    return False
+
+def rollback_reports_data(df):
+    """Восстановление реестра отчетов из версии истории загрузок"""
+    if save_reports_data(df):
+        st.session_state.reports_data = df
+        return True
+    return False
+
+def show_upload_history(kind, current_version, load_current, on_rollback, date_columns=None):
+    """
+    Отображение истории загрузок с откатом к выбранной версии
+    
+    Args:
+        kind (str): вид данных в истории (reports, requests)
+        current_version: признак текущих данных (меняется вместе с ними;
+            None — текущих данных нет)
+        load_current: функция без аргументов, возвращающая текущие данные
+            (вызывается только при сравнении версий)
+        on_rollback: функция, сохраняющая выбранную версию как текущую
+        date_columns (list): столбцы дат (для сравнения версий)
+    """
+    versions = snapshot_store.list_versions(kind)
+    if not versions:
+        return
+    
+    with st.expander(f"🕘 История загрузок ({len(versions)})", expanded=False):
+        selected = st.selectbox(
+            "Версия",
+            range(len(versions)),
+            format_func=lambda i: (
+                f"{datetime.fromisoformat(versions[i]['created_at']).strftime('%d.%m.%Y %H:%M')} — "
+                f"{versions[i]['source_name'] or 'без имени'} ({versions[i]['rows']} строк)"
+            ),
+            key=f"history_version_{kind}"
+        )
+        manifest = versions[selected]
+        
+        # Версия собирается и сравнивается только по кнопке: тело свернутого
+        # expander тоже выполняется при каждом перезапуске скрипта.
+        # Результаты сравнения запоминаются по версии (пока текущие данные те же)
+        if current_version is not None:
+            diffs = st.session_state.setdefault(f"history_diffs_{kind}", {})
+            if st.button("🔍 Сравнить с текущими данными", key=f"history_compare_{kind}"):
+                version_df = snapshot_store.load(kind, manifest['version_id'])
+                diffs[manifest['version_id']] = (
+                    current_version,
+                    snapshot_store.diff_summary(version_df, load_current(), date_columns),
+                    snapshot_store.disk_usage()
+                )
+            
+            saved = diffs.get(manifest['version_id'])
+            if saved is not None and saved[0] == current_version:
+                _, diff, disk_usage = saved
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Добавлено строк с этой версии", diff['added'])
+                with col2:
+                    st.metric("Удалено строк с этой версии", diff['removed'])
+                with col3:
+                    st.metric("Без изменений", diff['unchanged'])
+                st.caption(f"💾 Объем истории на диске: {disk_usage / 1024:.1f} KB")
+        
+        if st.button("↩️ Откатить к этой версии", key=f"history_rollback_{kind}"):
+            if on_rollback(snapshot_store.load(kind, manifest['version_id'])):
+                st.success("✅ Данные восстановлены из выбранной версии!")
+                st.rerun()
 
 def display_request_results(df):
     """Отображение результатов анализа запросов с фильтрами и поиском"""
@@ -1690,9 +2553,9 @@ def show_admin_dashboard():
                 st.info(f"📁 Файл данных: {file_time.strftime('%d.%m.%Y %H:%M')}")
         
         with col2:
-            if COMMENTS_DATA_FILE.exists():
-                file_time = datetime.fromtimestamp(COMMENTS_DATA_FILE.stat().st_mtime)
-                st.info(f"💬 Комментарии: {file_time.strftime('%d.%m.%Y %H:%M')}")
+            comments_time = comment_store.last_updated()
+            if comments_time is not None:
+                st.info(f"💬 Комментарии: {comments_time.strftime('%d.%m.%Y %H:%M')}")
     else:
         st.info("📊 Данные не загружены")
     
@@ -1702,64 +2565,77 @@ def show_admin_dashboard():
     
     uploaded_file = st.file_uploader(
         "Выберите файл с данными отчетов",
-        type=['xlsx', 'xls', 'csv'],
+        type=['xlsx', 'xlsm', 'xls', 'xlsb', 'ods', 'csv'],
         key="reports_file_uploader",
         help="При загрузке нового файла комментарии сохранятся для совпадающих отчетов"
     )
     
     if uploaded_file is not None:
-        try:
-            # Загружаем новые данные
-            if uploaded_file.name.endswith('.csv'):
-                new_df = pd.read_csv(uploaded_file)
-            else:
-                new_df = pd.read_excel(uploaded_file)
-            
-            # Сохраняем старые комментарии
-            old_comments = st.session_state.reports_comments.copy()
-            
-            # Обновляем данные
-            st.session_state.reports_data = new_df
-            
-            # Пытаемся сопоставить старые комментарии с новыми данными
-            new_comments = {}
-            if not new_df.empty and old_comments:
-                for old_idx, comment in old_comments.items():
-                    # Ищем совпадения по номеру формы или названию отчета
-                    if old_idx < len(st.session_state.reports_data):
-                        old_report_info = st.session_state.reports_data.iloc[old_idx] if old_idx < len(st.session_state.reports_data) else None
-                        if old_report_info is not None:
-                            # Ищем тот же отчет в новых данных
-                            for new_idx, row in new_df.iterrows():
-                                if (str(row.get('Номер формы', '')) == str(old_report_info.get('Номер формы', '')) and
-                                    str(row.get('Наименование отчета', '')) == str(old_report_info.get('Наименование отчета', ''))):
-                                    new_comments[new_idx] = comment
-                                    break
-            
-            st.session_state.reports_comments = new_comments
-            
-            # Сохраняем в постоянные файлы
-            if save_reports_data(new_df, st.session_state.reports_comments):
-                st.success("✅ Файл успешно загружен и сохранен!")
+        # Файл остается в загрузчике между перезапусками страницы. Он
+        # обрабатывается один раз: повторное сохранение сбросило бы журнал
+        # и потеряло бы правки ячеек, сделанные после загрузки
+        upload_state = st.session_state.get('reports_upload')
+        if upload_state is None or upload_state['file_id'] != uploaded_file.file_id:
+            upload_state = {'file_id': uploaded_file.file_id, 'messages': [], 'metrics': None}
+            st.session_state.reports_upload = upload_state
+            messages = upload_state['messages']
+            try:
+                # Загружаем новые данные
+                if uploaded_file.name.endswith('.csv'):
+                    new_df = read_csv(uploaded_file)
+                else:
+                    new_df = read_excel(uploaded_file)
                 
-                preserved_comments = len(new_comments)
-                if preserved_comments > 0:
-                    st.info(f"💬 Сохранено {preserved_comments} комментариев из предыдущей версии")
-            else:
-                st.error("❌ Ошибка при сохранении данных")
+                # Обновляем данные
+                st.session_state.reports_data = new_df
+                
+                # Комментарии привязаны к (Номер формы, Наименование отчета),
+                # поэтому для совпадающих отчетов они сохраняются автоматически
+                new_keys = set(report_keys(new_df))
+                new_comments = {
+                    key: comment for key, comment in st.session_state.reports_comments.items()
+                    if key in new_keys
+                }
+                
+                # Сохраняем в постоянные файлы
+                if save_reports_data(new_df):
+                    snapshot_store.save("reports", new_df, uploaded_file.name, date_columns=REPORTS_DATE_COLUMNS)
+                    messages.append(('success', "✅ Файл успешно загружен и сохранен!"))
+                    read_timing = format_read_timing(new_df)
+                    if read_timing:
+                        messages.append(('caption', read_timing))
+                    
+                    preserved_comments = len(new_comments)
+                    if preserved_comments > 0:
+                        messages.append(('info', f"💬 Сохранено {preserved_comments} комментариев из предыдущей версии"))
+                else:
+                    messages.append(('error', "❌ Ошибка при сохранении данных"))
+                
+                owners_count = new_df['Владелец отчета ССП'].nunique() if 'Владелец отчета ССП' in new_df.columns else 0
+                upload_state['metrics'] = (len(new_df), len(new_df.columns), owners_count)
             
-            # Показываем базовую информацию
+            except Exception as e:
+                messages.append(('error', f"❌ Ошибка при загрузке файла: {str(e)}"))
+        
+        for level, message in upload_state['messages']:
+            getattr(st, level)(message)
+        
+        # Показываем базовую информацию
+        if upload_state['metrics'] is not None:
+            reports_count, columns_count, owners_count = upload_state['metrics']
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Всего отчетов", len(new_df))
+                st.metric("Всего отчетов", reports_count)
             with col2:
-                st.metric("Столбцов данных", len(new_df.columns))
+                st.metric("Столбцов данных", columns_count)
             with col3:
-                owners_count = new_df['Владелец отчета ССП'].nunique() if 'Владелец отчета ССП' in new_df.columns else 0
                 st.metric("Уникальных владельцев", owners_count)
-        
-        except Exception as e:
-            st.error(f"❌ Ошибка при загрузке файла: {str(e)}")
+    
+    reports_df = st.session_state.reports_data
+    show_upload_history(
+        "reports", None if reports_df is None else id(reports_df),
+        lambda: reports_df, rollback_reports_data, REPORTS_DATE_COLUMNS
+    )
     
     # Отображение данных если они есть
     if st.session_state.reports_data is not None:
@@ -1838,7 +2714,7 @@ def show_admin_dashboard():
             for idx, row in filtered_df.iterrows():
                 option_text = f"{row.get('Номер формы', 'N/A')} - {row.get('Наименование отчета', 'N/A')}"
                 report_options.append(option_text)
-                report_indices.append(idx)
+                report_indices.append(report_key(row))
             
             selected_report_idx = st.selectbox(
                 "Выберите отчет для комментирования", 
@@ -1847,8 +2723,8 @@ def show_admin_dashboard():
             )
             
             if selected_report_idx is not None:
-                actual_idx = report_indices[selected_report_idx]
-                current_comment = st.session_state.reports_comments.get(actual_idx, '')
+                actual_key = report_indices[selected_report_idx]
+                current_comment = st.session_state.reports_comments.get(actual_key, '')
                 
                 new_comment = st.text_area(
                     "Комментарий", 
@@ -1861,32 +2737,55 @@ def show_admin_dashboard():
                 
                 with col1:
                     if st.button("💾 Сохранить комментарий", type="primary"):
-                        st.session_state.reports_comments[actual_idx] = new_comment
-                        
-                        # Сохраняем в постоянный файл
-                        if save_reports_data(st.session_state.reports_data, st.session_state.reports_comments):
+                        # Сохраняем только один комментарий, реестр не перезаписывается
+                        try:
+                            comment_store.upsert(actual_key, new_comment)
+                            st.session_state.reports_comments[actual_key] = new_comment
                             st.success("✅ Комментарий сохранен!")
-                        else:
-                            st.error("❌ Ошибка при сохранении комментария")
+                        except Exception as e:
+                            st.error(f"❌ Ошибка при сохранении комментария: {str(e)}")
                         st.rerun()
                 
                 with col2:
                     if st.button("🗑️ Удалить комментарий"):
-                        if actual_idx in st.session_state.reports_comments:
-                            del st.session_state.reports_comments[actual_idx]
-                            
-                            # Сохраняем в постоянный файл
-                            if save_reports_data(st.session_state.reports_data, st.session_state.reports_comments):
+                        if actual_key in st.session_state.reports_comments:
+                            try:
+                                comment_store.delete(actual_key)
+                                del st.session_state.reports_comments[actual_key]
                                 st.success("✅ Комментарий удален!")
-                            else:
-                                st.error("❌ Ошибка при удалении комментария")
+                            except Exception as e:
+                                st.error(f"❌ Ошибка при удалении комментария: {str(e)}")
                             st.rerun()
                 
                 # Показываем существующие комментарии
                 comments_count = len([c for c in st.session_state.reports_comments.values() if c.strip()])
                 if comments_count > 0:
                     st.info(f"📝 Всего комментариев в системе: {comments_count}")
-        
+
+                # Правка отдельных полей выбранного отчета (через журнал изменений)
+                st.markdown("### ✏️ Редактирование полей отчета")
+                selected_row = filtered_df.iloc[selected_report_idx]
+                editable_columns = [col for col in filtered_df.columns if col not in ('Номер формы', 'Наименование отчета')]
+
+                if editable_columns:
+                    edit_column = st.selectbox("Поле", editable_columns, key="cell_edit_column")
+                    current_value = selected_row.get(edit_column)
+                    if pd.isna(current_value):
+                        current_value = ''
+                    elif isinstance(current_value, pd.Timestamp):
+                        current_value = current_value.strftime('%d.%m.%Y')
+
+                    new_value = st.text_input(
+                        "Новое значение",
+                        value=str(current_value),
+                        key=f"cell_edit_value_{selected_report_idx}_{edit_column}"
+                    )
+
+                    if st.button("💾 Сохранить значение", key="cell_edit_save"):
+                        if save_report_cell(actual_key, edit_column, new_value.strip() or None):
+                            st.success("✅ Значение сохранено!")
+                        st.rerun()
+
         # Экспорт данных
         st.markdown("---")
         st.markdown("### 📥 Экспорт данных")
@@ -1897,11 +2796,9 @@ def show_admin_dashboard():
             if st.button("📊 Скачать отфильтрованные данные", type="primary"):
                 # Добавляем комментарии в DataFrame
                 export_df = filtered_df.copy()
-                export_df['Комментарий'] = ''
-                
-                for idx in export_df.index:
-                    if idx in st.session_state.reports_comments:
-                        export_df.at[idx, 'Комментарий'] = st.session_state.reports_comments[idx]
+                export_df['Комментарий'] = [
+                    st.session_state.reports_comments.get(key, '') for key in report_keys(export_df)
+                ]
                 
                 # Создаем Excel файл
                 output = io.BytesIO()
@@ -1919,11 +2816,9 @@ def show_admin_dashboard():
             if st.button("💾 Скачать все данные с комментариями"):
                 # Добавляем все комментарии в DataFrame
                 export_df = df.copy()
-                export_df['Комментарий'] = ''
-                
-                for idx in export_df.index:
-                    if idx in st.session_state.reports_comments:
-                        export_df.at[idx, 'Комментарий'] = st.session_state.reports_comments[idx]
+                export_df['Комментарий'] = [
+                    st.session_state.reports_comments.get(key, '') for key in report_keys(export_df)
+                ]
                 
                 # Создаем Excel файл
                 output = io.BytesIO()
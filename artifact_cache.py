@@ -0,0 +1,144 @@
+"""
+Дисковый кэш результатов преобразования шаблонов.
+
+Атрибутный состав полностью определяется содержимым загруженного файла и
+параметрами преобразования, поэтому результат (таблица метаданных и готовый
+xlsx) сохраняется под ключом из хэша файла, номера и типа отчета и версии
+трансформера. Повторная выгрузка того же файла берет результат из кэша,
+в том числе после перезапуска приложения.
+
+Размер кэша ограничен числом записей и объемом на диске. Время последнего
+обращения хранится во времени изменения файлов записи, поэтому при
+переполнении удаляются давно не использовавшиеся записи (LRU) без
+отдельного индекса.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from storage import get_backend
+
+# Ограничения кэша по умолчанию
+ARTIFACT_CACHE_MAX_ENTRIES = 200
+ARTIFACT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def artifact_key(*parts):
+    """Ключ записи кэша по набору параметров"""
+    payload = json.dumps([str(part) for part in parts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, root, max_entries=ARTIFACT_CACHE_MAX_ENTRIES,
+                 max_bytes=ARTIFACT_CACHE_MAX_BYTES, backend=None):
+        """
+        Кэш пар (DataFrame, байты файла) на диске
+
+        Args:
+            root (Path): директория кэша
+            max_entries (int): максимальное количество записей
+            max_bytes (int): максимальный объем записей на диске
+            backend: бэкенд хранения таблиц (см. storage.get_backend)
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend or get_backend()
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        return self.root / f"{key}{self.backend.suffix}", self.root / f"{key}.bin"
+
+    def get(self, key):
+        """
+        Запись кэша
+
+        Returns:
+            tuple: (DataFrame, байты) или None, если записи нет
+        """
+        table_path, data_path = self._paths(key)
+        with self._lock:
+            if not (table_path.exists() and data_path.exists()):
+                return None
+            try:
+                df = self.backend.read(table_path)
+                data = data_path.read_bytes()
+            except Exception:
+                # Поврежденная запись (например, после сбоя диска) считается отсутствующей
+                self._remove(key)
+                return None
+            # Отметка обращения для вытеснения давно не использовавшихся записей
+            for path in (table_path, data_path):
+                os.utime(path)
+        return df, data
+
+    def put(self, key, df, data):
+        """Сохранение записи с вытеснением старых записей при переполнении"""
+        table_path, data_path = self._paths(key)
+        table_tmp = table_path.with_name(f".{table_path.stem}.tmp{table_path.suffix}")
+        data_tmp = data_path.with_name(f".{data_path.stem}.tmp{data_path.suffix}")
+        with self._lock:
+            try:
+                self.backend.write(self.backend.prepare(df), table_tmp)
+                data_tmp.write_bytes(data)
+                # Байты записываются последними: запись видна только целиком
+                os.replace(table_tmp, table_path)
+                os.replace(data_tmp, data_path)
+            finally:
+                for path in (table_tmp, data_tmp):
+                    if path.exists():
+                        path.unlink()
+            self._evict()
+
+    def _entries(self):
+        """Записи кэша: ключ -> (время последнего обращения, размер)"""
+        entries = {}
+        for path in self.root.iterdir():
+            if path.name.startswith('.') or not path.is_file():
+                continue
+            stat = path.stat()
+            last_access, size = entries.get(path.stem, (0, 0))
+            entries[path.stem] = (max(last_access, stat.st_mtime_ns), size + stat.st_size)
+        return entries
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            if path.exists():
+                path.unlink()
+
+    def _evict(self):
+        entries = self._entries()
+        total_bytes = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if len(entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+            del entries[key]
+            total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries()):
+                self._remove(key)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_artifact_cache(root, **kwargs):
+    """
+    Кэш для директории
+
+    Скрипт Streamlit выполняется заново при каждом действии пользователя,
+    поэтому кэш хранится в модуле и один на процесс.
+    """
+    key = str(Path(root).resolve())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ArtifactCache(root, **kwargs)
+        return _caches[key]
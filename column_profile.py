@@ -0,0 +1,318 @@
+"""
+Профилирование столбцов шаблона за один проход.
+
+Для каждого столбца оцениваются число различных значений (HyperLogLog) и
+самые частые значения (count-min sketch с ограниченным списком кандидатов).
+Данные обрабатываются фрагментами строк, а размер всех структур не зависит
+от длины столбца, поэтому память ограничена и для очень длинных шаблонов.
+
+Текстовые столбцы с небольшим числом различных значений, которые часто
+повторяются, считаются кандидатами в справочные атрибуты: в атрибутный
+состав для них подставляется признак «Справочный» и самые частые значения.
+
+Статистика столбцов (доля пустых, минимум/максимум, длина значений, пример)
+считается по столбцам: каждый столбец целиком обрабатывается векторными
+операциями pandas, поэтому в памяти одновременно строки только одного столбца.
+"""
+import numpy as np
+import pandas as pd
+
+from type_inference import TYPE_DATE, TYPE_NUMBER, TYPE_TEXT, value_counts
+
+# Точность HyperLogLog: 2**12 регистров, стандартная ошибка около 1.6%
+HLL_PRECISION = 12
+
+# Размер count-min sketch: ширина строки и число независимых хэшей
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+
+# Количество отслеживаемых кандидатов в частые значения
+HEAVY_HITTER_CANDIDATES = 64
+
+# Размер фрагмента в строках
+PROFILE_CHUNK_ROWS = 50_000
+
+# Условия справочного атрибута
+REFERENCE_MAX_DISTINCT = 50
+REFERENCE_MAX_DISTINCT_SHARE = 0.2
+REFERENCE_MIN_VALUES = 20
+REFERENCE_TOP_VALUES = 10
+
+# Множители для получения независимых хэшей count-min sketch из одного 64-битного хэша
+_CMS_MULTIPLIERS = np.array(
+    [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93],
+    dtype=np.uint64
+)
+
+
+def hash_values(strings):
+    """64-битные хэши строк"""
+    return pd.util.hash_array(np.asarray(strings, dtype=object))
+
+
+def _bit_length(values):
+    """Число значащих битов для uint64 (поэлементно)"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    # Для чисел меньше 2**32 frexp точен и возвращает длину в битах
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        """
+        Оценка числа различных значений
+
+        Args:
+            precision (int): число бит хэша, выбирающих регистр
+        """
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        value_bits = 64 - self.precision
+        index = (hashes >> np.uint64(value_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << value_bits) - 1)
+        # Позиция первой единицы в оставшихся битах (1 — старший бит)
+        rank = (value_bits - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            # Малые значения: линейный подсчет по пустым регистрам
+            return m * np.log(m / zeros)
+        return raw
+
+
+class CountMinSketch:
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        """
+        Оценка частот значений (оценка не меньше истинной частоты)
+
+        Args:
+            width (int): количество счетчиков в строке
+            depth (int): количество строк (независимых хэшей)
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _columns(self, hashes):
+        return [
+            ((hashes * _CMS_MULTIPLIERS[row]) >> np.uint64(32)) % np.uint64(self.width)
+            for row in range(self.depth)
+        ]
+
+    def add_hashes(self, hashes, weights):
+        for row, columns in enumerate(self._columns(hashes)):
+            np.add.at(self.table[row], columns.astype(np.int64), weights)
+
+    def estimate_hashes(self, hashes):
+        estimates = [self.table[row][columns.astype(np.int64)] for row, columns in enumerate(self._columns(hashes))]
+        return np.min(estimates, axis=0)
+
+
+class ColumnSketch:
+    def __init__(self, candidates=HEAVY_HITTER_CANDIDATES):
+        """
+        Профиль одного столбца
+
+        Args:
+            candidates (int): сколько частых значений отслеживать
+        """
+        self.count = 0
+        self.distinct = HyperLogLog()
+        self.frequencies = CountMinSketch()
+        self.capacity = candidates
+        self._candidates = {}
+
+    def add(self, values):
+        """Добавление фрагмента значений столбца"""
+        counts = value_counts(values)
+        if counts.empty:
+            return
+        self.count += int(counts.sum())
+
+        hashes = hash_values(counts.index)
+        self.distinct.add_hashes(hashes)
+        self.frequencies.add_hashes(hashes, counts.to_numpy(dtype=np.int64))
+
+        # Кандидаты: прежние и самые частые значения фрагмента, оценки — по sketch
+        fresh = {value: h for value, h in zip(counts.index[:self.capacity], hashes[:self.capacity])}
+        fresh.update(self._candidates)
+        names = list(fresh)
+        estimates = self.frequencies.estimate_hashes(np.array([fresh[name] for name in names], dtype=np.uint64))
+        top = np.argsort(-estimates, kind='stable')[:self.capacity]
+        self._candidates = {names[pos]: fresh[names[pos]] for pos in top}
+
+    def distinct_count(self):
+        """Оценка числа различных значений (не больше числа значений)"""
+        if len(self._candidates) < self.capacity:
+            # Все встреченные значения помещаются в список кандидатов — число точное
+            return len(self._candidates)
+        return min(int(round(self.distinct.estimate())), self.count)
+
+    def top_values(self, limit=REFERENCE_TOP_VALUES):
+        """
+        Самые частые значения
+
+        Returns:
+            list: пары (значение, оценка частоты) по убыванию частоты
+        """
+        if not self._candidates:
+            return []
+        names = list(self._candidates)
+        estimates = self.frequencies.estimate_hashes(np.array(list(self._candidates.values()), dtype=np.uint64))
+        order = np.argsort(-estimates, kind='stable')[:limit]
+        return [(names[pos], int(estimates[pos])) for pos in order]
+
+    def is_reference(self):
+        """Похож ли столбец на справочный (мало различных часто повторяющихся значений)"""
+        if self.count < REFERENCE_MIN_VALUES:
+            return False
+        distinct = self.distinct_count()
+        return distinct <= REFERENCE_MAX_DISTINCT and distinct / self.count <= REFERENCE_MAX_DISTINCT_SHARE
+
+
+def profile_columns(df, chunk_rows=PROFILE_CHUNK_ROWS):
+    """
+    Профили всех столбцов за один проход по строкам
+
+    Returns:
+        list: ColumnSketch в порядке столбцов df
+    """
+    sketches = [ColumnSketch() for _ in range(df.shape[1])]
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        for pos, sketch in enumerate(sketches):
+            sketch.add(chunk.iloc[:, pos])
+    return sketches
+
+
+def reference_info(sketch, data_type):
+    """
+    Признак атрибута и описание справочника по профилю столбца
+
+    Returns:
+        tuple: ('Справочный' или 'Базовый', частые значения через '; ' или '')
+    """
+    if data_type != TYPE_TEXT or not sketch.is_reference():
+        return 'Базовый', ''
+    values = [value for value, _ in sketch.top_values()]
+    if sketch.distinct_count() > len(values):
+        values.append('…')
+    return 'Справочный', '; '.join(values)
+
+
+def _numeric_values(strings):
+    """Числа из строк (',' — десятичный разделитель, пробелы — разделители разрядов)"""
+    normalized = strings.str.replace(',', '.', regex=False).str.replace(' ', '', regex=False)
+    normalized = normalized.where(normalized != '', 'nan')
+    try:
+        return normalized.to_numpy(dtype=object).astype(np.float64)
+    except ValueError:
+        # В столбце есть нечисловые значения: разбор с пропуском ошибок
+        return pd.to_numeric(normalized, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _date_values(values, strings):
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return pd.Series(values.to_numpy())
+    return pd.to_datetime(strings.where(strings != ''), format='mixed', dayfirst=True, errors='coerce')
+
+
+def _format_value(value, data_type):
+    if pd.isna(value):
+        return ''
+    if data_type == TYPE_DATE:
+        return value.strftime('%d.%m.%Y')
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.15g}"
+
+
+def _display_frame(df):
+    """Значения в том виде, в каком они видны в шаблоне (целые без .0, даты без времени)"""
+    converted = {}
+    for pos in range(df.shape[1]):
+        values = df.iloc[:, pos]
+        if pd.api.types.is_float_dtype(values.dtype):
+            clean = values.dropna()
+            if (clean == np.floor(clean)).all() and (clean.abs() < 2 ** 53).all():
+                converted[pos] = values.astype('Int64')
+        elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+            clean = values.dropna()
+            has_time = (clean != clean.dt.normalize()).any()
+            converted[pos] = values.dt.strftime('%d.%m.%Y %H:%M:%S' if has_time else '%d.%m.%Y')
+    if not converted:
+        return df
+    df = df.copy()
+    for pos, values in converted.items():
+        df.isetitem(pos, values)
+    return df
+
+
+def column_statistics(df, data_types):
+    """
+    Статистика всех столбцов
+
+    Пустыми считаются пропуски и строки из одних пробелов. Минимум и максимум
+    считаются для числовых столбцов и столбцов с датами, длины — по значениям
+    в строковом виде.
+
+    Args:
+        df (pandas.DataFrame): исходные данные
+        data_types (list): типы столбцов (см. type_inference)
+
+    Returns:
+        pandas.DataFrame: строка на столбец df — filled, null_share, min_length,
+            max_length, mean_length, min_value, max_value, example
+    """
+    n_rows = len(df)
+    display = _display_frame(df)
+
+    # Столбцы обрабатываются по одному: общий двумерный массив строк
+    # фиксированной ширины занимает память по самой длинной ячейке таблицы
+    rows = []
+    for pos, data_type in enumerate(data_types):
+        values = display.iloc[:, pos]
+        present = values.notna()
+        strings = values.astype(object).where(present, '').astype(str).str.strip()
+        filled = present & (strings != '')
+        filled_count = int(filled.sum())
+        lengths = strings[filled].str.len()
+
+        row = {
+            'filled': filled_count,
+            'null_share': 1 - filled_count / n_rows if n_rows else 0.0,
+            'min_length': int(lengths.min()) if filled_count else 0,
+            'max_length': int(lengths.max()) if filled_count else 0,
+            'mean_length': lengths.sum() / filled_count if filled_count else 0.0,
+            'min_value': '',
+            'max_value': '',
+            # Первое заполненное значение столбца — пример
+            'example': strings[filled].iloc[0] if filled_count else '',
+        }
+
+        # Минимум и максимум — для чисел и дат
+        if data_type == TYPE_NUMBER and filled_count:
+            numbers = _numeric_values(strings)
+            if not np.isnan(numbers).all():
+                row['min_value'] = _format_value(np.nanmin(numbers), TYPE_NUMBER)
+                row['max_value'] = _format_value(np.nanmax(numbers), TYPE_NUMBER)
+        elif data_type == TYPE_DATE:
+            parsed = _date_values(df.iloc[:, pos], strings)
+            row['min_value'] = _format_value(parsed.min(), TYPE_DATE)
+            row['max_value'] = _format_value(parsed.max(), TYPE_DATE)
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=[
+        'filled', 'null_share', 'min_length', 'max_length', 'mean_length',
+        'min_value', 'max_value', 'example'
+    ])
@@ -0,0 +1,166 @@
+"""
+Хранилище комментариев к отчетам.
+
+Комментарии хранятся в SQLite (режим WAL) и привязаны к устойчивому ключу
+отчета (Номер формы, Наименование отчета), а не к позиции строки в реестре.
+Сохранение или удаление одного комментария — одна короткая транзакция,
+реестр отчетов при этом не перезаписывается.
+"""
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+REPORT_KEY_COLUMNS = ['Номер формы', 'Наименование отчета']
+
+
+def report_key_part(value):
+    """Нормализация значения ключевого поля (101.0 и '101' дают один ключ)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def report_key(row):
+    """Ключ отчета для строки реестра"""
+    return tuple(report_key_part(row.get(col, '')) for col in REPORT_KEY_COLUMNS)
+
+
+def report_keys(df):
+    """Ключи отчетов для всех строк DataFrame (в порядке строк)"""
+    parts = []
+    for col in REPORT_KEY_COLUMNS:
+        if col in df.columns:
+            parts.append([report_key_part(v) for v in df[col].tolist()])
+        else:
+            parts.append([''] * len(df))
+    return list(zip(*parts))
+
+
+class CommentStore:
+    def __init__(self, db_path):
+        """
+        Транзакционное хранилище комментариев
+
+        Args:
+            db_path (Path): путь к файлу базы SQLite
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS comments (
+                    form_number TEXT NOT NULL,
+                    report_name TEXT NOT NULL,
+                    comment TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (form_number, report_name)
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (revision INTEGER NOT NULL)")
+            if conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0:
+                conn.execute("INSERT INTO meta (revision) VALUES (0)")
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _bump_revision(self, conn):
+        conn.execute("UPDATE meta SET revision = revision + 1")
+
+    def revision(self):
+        """Номер ревизии, увеличивается при каждом изменении комментариев"""
+        with self._connection() as conn:
+            return conn.execute("SELECT revision FROM meta").fetchone()[0]
+
+    def load_all(self):
+        """Все комментарии в виде {(Номер формы, Наименование отчета): комментарий}"""
+        with self._connection() as conn:
+            rows = conn.execute("SELECT form_number, report_name, comment FROM comments").fetchall()
+        return {(form_number, report_name): comment for form_number, report_name, comment in rows}
+
+    def last_updated(self):
+        """Время последнего изменения комментариев (None, если комментариев нет)"""
+        with self._connection() as conn:
+            value = conn.execute("SELECT MAX(updated_at) FROM comments").fetchone()[0]
+        return datetime.fromisoformat(value) if value else None
+
+    def upsert(self, key, comment):
+        """Сохранение комментария к отчету"""
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO comments (form_number, report_name, comment, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (form_number, report_name)
+                DO UPDATE SET comment = excluded.comment, updated_at = excluded.updated_at
+                """,
+                (key[0], key[1], comment, datetime.now().isoformat(timespec='seconds'))
+            )
+            self._bump_revision(conn)
+
+    def delete(self, key):
+        """Удаление комментария к отчету"""
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM comments WHERE form_number = ? AND report_name = ?",
+                (key[0], key[1])
+            )
+            self._bump_revision(conn)
+
+    def migrate_from_json(self, json_path, reports_df):
+        """
+        Однократный перенос комментариев из comments_data.json
+
+        В JSON комментарии хранились по позиционному индексу строки реестра,
+        поэтому ключи восстанавливаются по текущему реестру. Файл
+        переименовывается в *.json.migrated, только если перенесен хотя бы
+        один комментарий; пока реестра нет (новая установка, реестр не
+        загружен), файл остается на месте и перенос повторяется при
+        следующем запуске.
+
+        Returns:
+            int: количество перенесенных комментариев
+        """
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+
+        with open(json_path, 'r', encoding='utf-8') as f:
+            comments_data = json.load(f)
+
+        migrated = 0
+        if reports_df is not None and not reports_df.empty:
+            keys = report_keys(reports_df)
+            now = datetime.now().isoformat(timespec='seconds')
+            with self._connection() as conn:
+                for idx, comment in comments_data.items():
+                    idx = int(idx)
+                    if 0 <= idx < len(keys):
+                        conn.execute(
+                            """
+                            INSERT OR REPLACE INTO comments (form_number, report_name, comment, updated_at)
+                            VALUES (?, ?, ?, ?)
+                            """,
+                            (keys[idx][0], keys[idx][1], comment, now)
+                        )
+                        migrated += 1
+                self._bump_revision(conn)
+
+        # Пустой файл переносить нечего — его тоже можно убрать
+        if migrated or not comments_data:
+            json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        return migrated
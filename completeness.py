@@ -0,0 +1,262 @@
+"""
+Правила полноты заполнения реестра отчетов.
+
+Правила описываются данными: поля, обязательные только при определенном
+значении другого столбца (ConditionalField), и значения, при которых отчет
+нужно доработать (ValueCheck). Правила переводятся в маски один раз и
+проверяются за один проход по реестру; по результату считаются и процент
+заполнения, и рекомендации по актуализации. Новое правило — это новая
+запись в списке, а не еще один проход по данным.
+"""
+import numpy as np
+import pandas as pd
+
+PUBLISHED_STAGE = 'Опубликован'
+
+
+def lower_text(df, column):
+    """Значения столбца в виде str(value).lower() ('' для всех строк, если столбца нет)"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    return df[column].astype(str).str.lower()
+
+
+def filled_matrix(df):
+    """
+    Матрица заполненных ячеек реестра
+
+    Ячейка заполнена, если значение не пустое и не состоит из одних пробелов.
+    Числа и даты проверяются только на пропуск, строки — еще и на пробелы.
+
+    Returns:
+        numpy.ndarray: bool-матрица размера df.shape
+    """
+    filled = df.notna().to_numpy()
+    for pos, dtype in enumerate(df.dtypes):
+        if dtype.kind in 'biufcmM':
+            continue
+        filled[:, pos] &= (df.iloc[:, pos].astype(str).str.strip() != '').to_numpy()
+    return filled
+
+
+class ConditionalField:
+    def __init__(self, field, column, equals=None, not_equals=None):
+        """
+        Поле, которое учитывается в заполненности только при условии
+
+        Args:
+            field (str): проверяемое поле
+            column (str): столбец условия (сравнение без учета регистра)
+            equals (str): поле учитывается, если значение столбца равно equals
+            not_equals (str): поле учитывается, если значение столбца не равно not_equals
+        """
+        self.field = field
+        self.column = column
+        self.equals = equals
+        self.not_equals = not_equals
+
+    def applies(self, df):
+        """Строки, в которых поле учитывается"""
+        values = lower_text(df, self.column)
+        if self.equals is not None:
+            return (values == self.equals).to_numpy()
+        return (values != self.not_equals).to_numpy()
+
+
+class ValueCheck:
+    def __init__(self, column, value, comment):
+        """
+        Значение столбца, при котором отчет нужно доработать
+
+        Args:
+            column (str): проверяемый столбец (сравнение без учета регистра)
+            value (str): значение, требующее доработки
+            comment (str): рекомендация
+        """
+        self.column = column
+        self.value = value
+        self.comment = comment
+
+    def matches(self, df):
+        return (lower_text(df, self.column) == self.value).to_numpy()
+
+
+# Правила реестра отчетов
+CONDITIONAL_FIELDS = [
+    ConditionalField(
+        'ССП, в функциональном подчинении которого, находятся сотрудники РФ',
+        'Участие в формировании РФ', not_equals='нет'
+    ),
+    ConditionalField('Частота отчета (ручной ввод)', 'Частота отчета', equals='ручной ввод'),
+]
+
+VALUE_CHECKS = [
+    ValueCheck('Шаблон отчета', 'нет', "Добавить шаблон"),
+    ValueCheck('Атрибуты описаны', 'нет', "Описать атрибуты"),
+]
+
+
+def empty_field_names(empty, columns):
+    """
+    Списки незаполненных полей по строкам
+
+    Маска пустых полей каждой строки упаковывается в биты; различные маски
+    (в реестре их обычно немного) переводятся в названия столбцов один раз.
+
+    Args:
+        empty (numpy.ndarray): bool-матрица пустых учитываемых ячеек
+        columns: названия столбцов матрицы
+
+    Returns:
+        numpy.ndarray: названия пустых полей через '; ' ('' если пустых нет)
+    """
+    if len(empty) == 0:
+        return np.array([], dtype=object)
+    packed = np.packbits(empty, axis=1)
+    row_keys = np.ascontiguousarray(packed).view(np.dtype((np.void, packed.shape[1]))).ravel()
+    unique_keys, inverse = np.unique(row_keys, return_inverse=True)
+
+    columns = np.asarray(columns, dtype=object)
+    names = [
+        '; '.join(columns[np.unpackbits(np.frombuffer(key.tobytes(), dtype=np.uint8))[:len(columns)].astype(bool)])
+        for key in unique_keys
+    ]
+    return np.asarray(names, dtype=object)[inverse.ravel()]
+
+
+def join_nonempty(parts, sep='; '):
+    """Поэлементное объединение непустых строк нескольких массивов"""
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.where(part == '', result, np.where(result == '', part, result + sep + part))
+    return result
+
+
+class CompletenessRules:
+    def __init__(self, conditional_fields=None, value_checks=None):
+        """
+        Набор правил полноты реестра
+
+        Args:
+            conditional_fields (list): ConditionalField (по умолчанию CONDITIONAL_FIELDS)
+            value_checks (list): ValueCheck (по умолчанию VALUE_CHECKS)
+        """
+        self.conditional_fields = CONDITIONAL_FIELDS if conditional_fields is None else conditional_fields
+        self.value_checks = VALUE_CHECKS if value_checks is None else value_checks
+
+    def evaluate(self, df):
+        """Проверка реестра всеми правилами за один проход"""
+        return CompletenessReport(self, df)
+
+
+class CompletenessReport:
+    def __init__(self, rules, df):
+        """
+        Результат проверки реестра: маски по строкам и ячейкам
+
+        Args:
+            rules (CompletenessRules): правила
+            df (pandas.DataFrame): реестр отчетов
+        """
+        self.df = df
+
+        counted = np.ones(df.shape, dtype=bool)
+        for rule in rules.conditional_fields:
+            positions = np.flatnonzero(df.columns == rule.field)
+            if len(positions):
+                counted[:, positions] &= rule.applies(df)[:, None]
+        filled = filled_matrix(df)
+
+        self.empty = counted & ~filled
+        self.counted_cells = counted.sum(axis=1)
+        self.filled_cells = (counted & filled).sum(axis=1)
+
+        if 'Этап отчета' in df.columns:
+            self.status = df['Этап отчета']
+        else:
+            self.status = pd.Series('', index=df.index)
+        self.published = (self.status == PUBLISHED_STAGE).to_numpy()
+
+        self.checks = [(check.comment, check.matches(df)) for check in rules.value_checks]
+
+    def completion_rate(self, rows=None):
+        """
+        Процент заполнения учитываемых полей
+
+        Args:
+            rows (numpy.ndarray): bool-маска строк (по умолчанию — весь реестр)
+        """
+        counted = self.counted_cells if rows is None else self.counted_cells[rows]
+        filled = self.filled_cells if rows is None else self.filled_cells[rows]
+        total_cells = int(counted.sum())
+        return (int(filled.sum()) / total_cells * 100) if total_cells > 0 else 0
+
+    def published_rate(self, rows=None):
+        """Процент опубликованных отчетов"""
+        published = self.published if rows is None else self.published[rows]
+        return (int(published.sum()) / len(published) * 100) if len(published) > 0 else 0
+
+    def rates_by(self, keys):
+        """
+        Показатели по группам строк за один проход
+
+        Args:
+            keys (pandas.Series): ключ группы для каждой строки реестра (пропуски не учитываются)
+
+        Returns:
+            pandas.DataFrame: индекс — ключ группы; completion_rate, published_rate, total
+        """
+        sums = pd.DataFrame({
+            'filled': self.filled_cells,
+            'counted': self.counted_cells,
+            'published': self.published.astype(np.int64),
+            'total': 1
+        }, index=self.df.index).groupby(keys).sum()
+
+        counted = sums['counted'].to_numpy()
+        total = sums['total'].to_numpy()
+        return pd.DataFrame({
+            'completion_rate': np.divide(sums['filled'].to_numpy() * 1.0, counted, out=np.zeros(len(sums)), where=counted > 0) * 100,
+            'published_rate': np.divide(sums['published'].to_numpy() * 1.0, total, out=np.zeros(len(sums)), where=total > 0) * 100,
+            'total': total
+        }, index=sums.index)
+
+    def update_recommendations(self):
+        """
+        Отчеты, требующие актуализации, с действиями и комментариями
+
+        Returns:
+            pandas.DataFrame: рекомендации (пустой DataFrame без столбцов, если их нет)
+        """
+        has_empty = self.empty.any(axis=1)
+        needs_update = ~self.published | has_empty
+        for _, mask in self.checks:
+            needs_update = needs_update | mask
+        if not needs_update.any():
+            return pd.DataFrame()
+
+        published = self.published[needs_update]
+        has_empty = has_empty[needs_update]
+
+        actions = np.where(
+            ~published, "Необходимо довести отчет до публикации",
+            np.where(has_empty, "Создать запрос на актуализацию", "")
+        ).astype(object)
+
+        fields = empty_field_names(self.empty[needs_update], self.df.columns)
+        comments = join_nonempty(
+            [np.where(has_empty, "Заполнить поля (" + fields + ")", "").astype(object)]
+            + [np.where(mask[needs_update], comment, "").astype(object) for comment, mask in self.checks]
+        )
+
+        def column(name):
+            return self.df[name].to_numpy()[needs_update] if name in self.df.columns else ''
+
+        return pd.DataFrame({
+            'Номер формы': column('Номер формы'),
+            'Наименование отчета': column('Наименование отчета'),
+            'Этап отчета': self.status.to_numpy()[needs_update],
+            'Владелец отчета ССП': column('Владелец отчета ССП'),
+            'Необходимые действия': actions,
+            'Доп. комментарии': comments
+        })
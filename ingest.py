@@ -0,0 +1,419 @@
+"""
+Загрузка выгрузок из файлов.
+
+Формат CSV (кодировка, разделитель, кавычки, строка заголовка) определяется
+по первым килобайтам файла, после чего файл разбирается ровно один раз.
+Для задач, которым нужны только названия столбцов и образец данных, есть
+облегченное чтение заголовка и первых строк файла.
+
+Excel и OpenDocument (.xlsx, .xlsm, .xls, .xlsb, .ods) читаются через
+read_excel: если установлен python-calamine, используется он (в разы быстрее
+openpyxl), иначе — стандартный движок pandas для расширения файла. Движок и
+время чтения сохраняются в атрибутах результата.
+
+История стадий запросов может содержать миллионы строк, а для итоговой
+таблицы по каждому business_id нужны только две строки: самая новая по
+created_at и строка с максимальным ts_from. CSV читается фрагментами
+ограниченного размера, и каждый фрагмент сразу сворачивается в эти
+агрегаты, поэтому в памяти одновременно находятся только один фрагмент
+и по паре строк на запрос.
+"""
+import codecs
+import csv
+import io
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Безопасный импорт openpyxl (чтение xlsx в режиме read_only)
+try:
+    from openpyxl import load_workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+# Безопасный импорт python-calamine (движок pandas 'calamine')
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+# Форматы электронных таблиц и движки pandas для них (если calamine не установлен)
+EXCEL_ENGINES = {
+    '.xlsx': 'openpyxl',
+    '.xlsm': 'openpyxl',
+    '.xls': 'xlrd',
+    '.xlsb': 'pyxlsb',
+    '.ods': 'odf',
+}
+EXCEL_EXTENSIONS = tuple(EXCEL_ENGINES)
+
+# Размер фрагмента CSV в строках
+CSV_CHUNK_ROWS = 200_000
+
+# Объем начала файла, по которому определяется формат CSV
+CSV_SNIFF_BYTES = 64 * 1024
+
+# Разделители, которые встречаются в выгрузках (Excel с русской локалью сохраняет через ";")
+CSV_DELIMITERS = [',', ';', '\t', '|']
+
+# Количество строк данных, читаемых в облегченном режиме
+HEADER_SAMPLE_ROWS = 5000
+
+# Столбцы, без которых историю запросов нельзя свернуть
+REQUEST_HISTORY_REQUIRED_COLUMNS = ['business_id', 'created_at', 'ts_from']
+
+
+class CsvFormat:
+    def __init__(self, encoding='utf-8', sep=',', quotechar='"', skiprows=0):
+        """
+        Параметры разбора CSV-файла
+
+        Args:
+            encoding (str): кодировка
+            sep (str): разделитель столбцов
+            quotechar (str): символ кавычек
+            skiprows (int): количество строк перед заголовком
+        """
+        self.encoding = encoding
+        self.sep = sep
+        self.quotechar = quotechar
+        self.skiprows = skiprows
+
+    def read_kwargs(self):
+        """Параметры для pd.read_csv"""
+        kwargs = {'encoding': self.encoding, 'sep': self.sep, 'quotechar': self.quotechar}
+        if self.skiprows:
+            kwargs['skiprows'] = self.skiprows
+        return kwargs
+
+    def __repr__(self):
+        return (f"CsvFormat(encoding={self.encoding!r}, sep={self.sep!r}, "
+                f"quotechar={self.quotechar!r}, skiprows={self.skiprows})")
+
+
+def _read_sample(source, sample_bytes):
+    """Начало файла без изменения текущей позиции"""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source[:sample_bytes])
+    if hasattr(source, 'read'):
+        position = source.tell()
+        sample = source.read(sample_bytes)
+        source.seek(position)
+        return sample
+    with open(source, 'rb') as f:
+        return f.read(sample_bytes)
+
+
+def _detect_encoding(sample):
+    """Кодировка и декодированный текст начала файла"""
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
+        try:
+            # final=False: многобайтовый символ может быть обрезан на границе образца
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'cp1251'
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    return encoding, text
+
+
+def _detect_delimiter(lines):
+    """Разделитель, дающий одинаковое (и наибольшее) число столбцов в строках образца"""
+    best_sep, best_score = ',', (0, 0)
+    for sep in CSV_DELIMITERS:
+        counts = [len(row) for row in csv.reader(lines, delimiter=sep) if row]
+        if not counts:
+            continue
+        columns, frequency = Counter(counts).most_common(1)[0]
+        if columns < 2:
+            continue
+        score = (frequency, columns)
+        if score > best_score:
+            best_sep, best_score = sep, score
+    return best_sep
+
+
+def sniff_csv(source, sample_bytes=CSV_SNIFF_BYTES):
+    """
+    Определение формата CSV по началу файла
+
+    Args:
+        source: путь, bytes или файловый объект (позиция не меняется)
+        sample_bytes (int): объем анализируемого начала файла
+
+    Returns:
+        CsvFormat: параметры разбора
+    """
+    sample = _read_sample(source, sample_bytes)
+    encoding, text = _detect_encoding(sample)
+
+    lines = text.splitlines()
+    if len(sample) >= sample_bytes and len(lines) > 1:
+        # Последняя строка образца, скорее всего, обрезана
+        lines = lines[:-1]
+
+    sep = _detect_delimiter(lines)
+
+    quotechar = '"'
+    try:
+        sniffed = csv.Sniffer().sniff("\n".join(lines[:50]), delimiters=sep)
+        if sniffed.quotechar in ('"', "'"):
+            quotechar = sniffed.quotechar
+    except csv.Error:
+        pass
+
+    # Строки-заголовки выгрузки (название отчета, период) перед строкой с именами столбцов
+    skiprows = 0
+    rows = [(idx, row) for idx, row in enumerate(csv.reader(lines, delimiter=sep, quotechar=quotechar)) if row]
+    if rows:
+        columns = Counter(len(row) for _, row in rows).most_common(1)[0][0]
+        if columns > 1:
+            for idx, row in rows:
+                if len(row) > 1:
+                    skiprows = idx
+                    break
+
+    return CsvFormat(encoding=encoding, sep=sep, quotechar=quotechar, skiprows=skiprows)
+
+
+def read_csv(source, csv_format=None, **kwargs):
+    """
+    Однократное чтение CSV с автоматически определенным форматом
+
+    Args:
+        source: путь, bytes или файловый объект
+        csv_format (CsvFormat): заранее определенный формат (по умолчанию — sniff_csv)
+        **kwargs: дополнительные параметры pd.read_csv
+
+    Returns:
+        pandas.DataFrame: загруженные данные
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if csv_format is None:
+        csv_format = sniff_csv(source)
+    return pd.read_csv(source, **{**csv_format.read_kwargs(), **kwargs})
+
+
+def excel_engines(file_name=None):
+    """Движки чтения в порядке попытки (None — выбор pandas по содержимому файла)"""
+    suffix = Path(file_name).suffix.lower() if file_name else ''
+    engines = ['calamine'] if CALAMINE_AVAILABLE else []
+    engines.append(EXCEL_ENGINES.get(suffix))
+    return engines
+
+
+def read_excel(source, file_name=None, **kwargs):
+    """
+    Чтение Excel/OpenDocument самым быстрым доступным движком
+
+    Если быстрый движок не смог прочитать файл, используется стандартный.
+    Движок и время чтения в секундах сохраняются в df.attrs
+    ('read_engine', 'read_seconds'), см. format_read_timing.
+
+    Args:
+        source: путь, bytes или файловый объект
+        file_name (str): имя файла (по умолчанию — из source)
+        **kwargs: дополнительные параметры pd.read_excel
+
+    Returns:
+        pandas.DataFrame: загруженные данные
+    """
+    if isinstance(source, (str, Path)):
+        file_name = file_name or str(source)
+        open_source = lambda: source
+    else:
+        file_name = file_name or getattr(source, 'name', None)
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+        elif hasattr(source, 'getvalue'):
+            data = source.getvalue()
+        else:
+            position = source.tell()
+            data = source.read()
+            source.seek(position)
+        open_source = lambda: io.BytesIO(data)
+
+    engines = excel_engines(file_name)
+    for attempt, engine in enumerate(engines, 1):
+        start = time.perf_counter()
+        try:
+            df = pd.read_excel(open_source(), engine=engine, **kwargs)
+        except Exception:
+            if attempt == len(engines):
+                raise
+            continue
+        df.attrs['read_engine'] = engine or 'auto'
+        df.attrs['read_seconds'] = time.perf_counter() - start
+        return df
+
+
+def format_read_timing(df):
+    """Строка для интерфейса: время чтения файла и движок ('' если неизвестно)"""
+    if 'read_seconds' not in df.attrs:
+        return ''
+    return f"⏱️ Файл прочитан за {df.attrs['read_seconds']:.2f} с (движок: {df.attrs['read_engine']})"
+
+
+def _count_csv_rows(data, csv_format):
+    """Количество строк данных CSV (по переводам строк, без заголовка)"""
+    lines = data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        lines += 1
+    return max(lines - 1 - csv_format.skiprows, 0)
+
+
+def read_header_sample(data, file_name, nrows=HEADER_SAMPLE_ROWS):
+    """
+    Облегченное чтение файла: заголовок и первые nrows строк
+
+    xlsx открывается в режиме read_only, строки дальше nrows не разбираются,
+    а общее число строк берется из размеров листа.
+
+    Args:
+        data (bytes): содержимое файла
+        file_name (str): имя файла (по расширению выбирается способ чтения)
+        nrows (int): количество строк данных (None — все строки)
+
+    Returns:
+        tuple: (DataFrame с первыми строками, общее число строк данных или None)
+    """
+    extension = file_name.rsplit('.', 1)[-1].lower()
+
+    if extension == 'csv':
+        csv_format = sniff_csv(data)
+        df = read_csv(data, csv_format=csv_format, nrows=nrows)
+        return df, _count_csv_rows(data, csv_format)
+
+    if extension == 'xlsx' and OPENPYXL_AVAILABLE:
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = workbook.worksheets[0]
+            total_rows = sheet.max_row - 1 if sheet.max_row else None
+            # pandas принимает открытую книгу и читает только первые nrows строк
+            df = pd.read_excel(workbook, nrows=nrows, engine='openpyxl')
+        finally:
+            workbook.close()
+        return df, total_rows
+
+    return read_excel(data, file_name, nrows=nrows), None
+
+
+class RequestHistoryAggregator:
+    def __init__(self, prepare_chunk=None):
+        """
+        Свертка истории стадий запросов по business_id
+
+        Выбор строк совпадает с полной обработкой: самая новая строка по
+        created_at (пустые даты в конце) и строка с максимальным ts_from
+        (если ts_from пуст во всех строках — последняя строка запроса).
+        При равных датах берется строка, встретившаяся в файле раньше.
+
+        Args:
+            prepare_chunk: функция подготовки фрагмента (например, конвертация дат)
+        """
+        self.prepare_chunk = prepare_chunk
+        self.rows = 0
+        self._unique = None
+        self._latest = None
+
+    def add_chunk(self, chunk):
+        """
+        Добавление очередного фрагмента выгрузки
+
+        Returns:
+            pandas.DataFrame: фрагмент после очистки и подготовки
+        """
+        missing = [col for col in REQUEST_HISTORY_REQUIRED_COLUMNS if col not in chunk.columns]
+        if missing:
+            raise ValueError(f"В файле отсутствуют столбцы: {', '.join(missing)}")
+
+        # Удаляем полностью пустые строки и строки с пустым business_id
+        chunk = chunk.dropna(how='all').dropna(subset=['business_id'])
+        if self.prepare_chunk is not None:
+            chunk = self.prepare_chunk(chunk)
+
+        prepared = chunk.reset_index(drop=True)
+        chunk = prepared.assign(_row=np.arange(self.rows, self.rows + len(prepared)))
+        self.rows += len(chunk)
+
+        self._unique = self._reduce_unique(self._concat(self._unique, chunk))
+        self._latest = self._reduce_latest(self._concat(self._latest, chunk))
+        return prepared
+
+    @staticmethod
+    def _concat(state, chunk):
+        if state is None:
+            return chunk
+        return pd.concat([state, chunk], ignore_index=True)
+
+    @staticmethod
+    def _reduce_unique(df):
+        """Самая новая строка по created_at для каждого запроса"""
+        df = df.sort_values(
+            ['created_at', '_row'], ascending=[False, True], na_position='last', kind='stable'
+        )
+        return df.drop_duplicates(subset='business_id', keep='first')
+
+    @staticmethod
+    def _reduce_latest(df):
+        """Строка с максимальным ts_from (или последняя строка) для каждого запроса"""
+        has_ts = df['ts_from'].notna()
+        order = df.assign(
+            _has_ts=has_ts,
+            _order=np.where(has_ts, df['_row'], -df['_row'])
+        ).sort_values(
+            ['_has_ts', 'ts_from', '_order'], ascending=[False, False, True], kind='stable'
+        )
+        return df.loc[order.drop_duplicates(subset='business_id', keep='first').index]
+
+    def result(self):
+        """
+        Итоговые агрегаты
+
+        Returns:
+            tuple: (уникальные запросы от новых к старым, строки с последним ts_from)
+        """
+        if self._unique is None:
+            empty = pd.DataFrame(columns=REQUEST_HISTORY_REQUIRED_COLUMNS)
+            return empty, empty
+        return (
+            self._unique.drop(columns='_row').reset_index(drop=True),
+            self._latest.drop(columns='_row').reset_index(drop=True)
+        )
+
+
+def aggregate_request_history_csv(source, prepare_chunk=None, chunk_rows=CSV_CHUNK_ROWS,
+                                  on_chunk=None, on_rows=None, **read_kwargs):
+    """
+    Потоковое чтение CSV с историей стадий запросов
+
+    Args:
+        source: путь или файловый объект
+        prepare_chunk: функция подготовки фрагмента
+        chunk_rows (int): размер фрагмента в строках
+        on_chunk: необязательная функция (прочитано строк), вызывается после каждого фрагмента
+        on_rows: необязательная функция, получающая каждый подготовленный фрагмент
+            (например, для записи полной истории по частям)
+        **read_kwargs: дополнительные параметры pd.read_csv
+
+    Returns:
+        RequestHistoryAggregator: свернутая история
+    """
+    read_kwargs = {**sniff_csv(source).read_kwargs(), **read_kwargs}
+    aggregator = RequestHistoryAggregator(prepare_chunk)
+    with pd.read_csv(source, chunksize=chunk_rows, **read_kwargs) as reader:
+        for chunk in reader:
+            rows = aggregator.add_chunk(chunk)
+            if on_rows is not None:
+                on_rows(rows)
+            if on_chunk is not None:
+                on_chunk(aggregator.rows)
+    return aggregator
@@ -0,0 +1,245 @@
+"""
+Фоновая обработка загруженных файлов.
+
+Чтение, обработка и сохранение больших выгрузок выполняются в пуле потоков,
+а не в потоке скрипта Streamlit: страница не блокируется, а перезапуск
+скрипта во время обработки не начинает ее заново. Каждая задача получает
+идентификатор, сообщает прогресс, может быть отменена, а ее состояние
+сохраняется на диск и переживает перезапуск приложения.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# Состояния задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = {JOB_DONE, JOB_FAILED, JOB_CANCELLED}
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем"""
+
+
+class IngestionJob:
+    def __init__(self, kind, name, dedup_key=None):
+        """
+        Задача обработки загруженного файла
+
+        Args:
+            kind (str): вид данных (requests, reports)
+            name (str): имя загруженного файла
+            dedup_key: ключ, по которому одинаковые загрузки не запускаются повторно
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.name = name
+        self.dedup_key = dedup_key
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.message = "В очереди"
+        self.error = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+
+        self._cancel_event = threading.Event()
+        self._on_change = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def update(self, progress, message=None):
+        """Обновление прогресса (вызывается из функции задачи)"""
+        self.check_cancelled()
+        self.progress = max(0.0, min(1.0, float(progress)))
+        if message is not None:
+            self.message = message
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def check_cancelled(self):
+        """Прерывание задачи, если запрошена отмена"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        """Запрос отмены (задача остановится на ближайшей контрольной точке)"""
+        self._cancel_event.set()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobRunner:
+    def __init__(self, state_dir, max_workers=2):
+        """
+        Общий для процесса исполнитель фоновых задач
+
+        Args:
+            state_dir (Path): директория с сохраненными состояниями задач
+            max_workers (int): количество одновременно обрабатываемых файлов
+        """
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._resource_locks = {}
+
+    def resource_lock(self, name):
+        """
+        Блокировка общего ресурса (например, таблицы)
+
+        Задачи выполняются параллельно, поэтому чтение-изменение-запись одной
+        таблицы выполняется под этой блокировкой: иначе одновременные загрузки
+        перезапишут результаты друг друга. Блокировка повторно входимая.
+        """
+        with self._lock:
+            return self._resource_locks.setdefault(name, threading.RLock())
+
+    def _state_path(self, job_id):
+        return self.state_dir / f"{job_id}.json"
+
+    def _persist(self, job):
+        """Атомарное сохранение состояния задачи"""
+        path = self._state_path(job.id)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def submit(self, kind, name, fn, *args, dedup_key=None, **kwargs):
+        """
+        Запуск задачи
+
+        Функция вызывается как fn(job, *args, **kwargs) в рабочем потоке, сообщает
+        прогресс через job.update() и не должна обращаться к st.*. Если задача с
+        тем же dedup_key еще выполняется, возвращается она.
+
+        Returns:
+            IngestionJob: созданная или уже выполняющаяся задача
+        """
+        with self._lock:
+            if dedup_key is not None:
+                for job in self._jobs.values():
+                    if job.dedup_key == dedup_key and not job.finished:
+                        return job
+
+            job = IngestionJob(kind, name, dedup_key)
+            job._on_change = self._persist
+            self._jobs[job.id] = job
+        self._persist(job)
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            job.status = JOB_RUNNING
+            job.update(0.0, "Обработка")
+            job.result = fn(job, *args, **kwargs)
+            job.status = JOB_DONE
+            job.progress = 1.0
+            job.message = "Готово"
+        except JobCancelled:
+            job.status = JOB_CANCELLED
+            job.message = "Отменено"
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)
+            job.message = "Ошибка"
+            logger.exception("Ошибка фоновой задачи %s (%s)", job.id, job.name)
+        finally:
+            job.finished_at = datetime.now()
+            self._persist(job)
+
+    def get(self, job_id):
+        """Задача текущего запуска приложения (None, если не найдена)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def saved_state(self, job_id):
+        """
+        Сохраненное состояние задачи (в том числе из предыдущего запуска)
+
+        Незавершенные задачи предыдущего запуска помечаются как прерванные.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+
+        path = self._state_path(job_id)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state['status'] not in FINISHED_STATUSES:
+            state['status'] = JOB_FAILED
+            state['error'] = "Обработка прервана перезапуском приложения"
+        return state
+
+    def active_jobs(self, kind=None):
+        """Выполняющиеся задачи (в порядке запуска)"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if not job.finished]
+        if kind is not None:
+            jobs = [job for job in jobs if job.kind == kind]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+            return True
+        return False
+
+    def forget(self, job_id):
+        """Освобождение результата завершенной задачи из памяти"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished:
+                del self._jobs[job_id]
+
+
+_runners = {}
+_runners_lock = threading.Lock()
+
+
+def get_job_runner(state_dir, max_workers=2):
+    """
+    Исполнитель задач для директории состояний
+
+    Скрипт Streamlit выполняется заново при каждом действии пользователя,
+    поэтому исполнитель хранится в модуле и один на процесс.
+    """
+    key = str(Path(state_dir).resolve())
+    with _runners_lock:
+        if key not in _runners:
+            _runners[key] = JobRunner(state_dir, max_workers=max_workers)
+        return _runners[key]
@@ -0,0 +1,226 @@
+"""
+Журнал изменений реестра отчетов.
+
+Правки реестра (изменения отдельных ячеек) дописываются в конец журнала
+(JSON Lines) вместо перезаписи всего файла данных. При чтении журнал
+применяется поверх последнего снимка, а фоновая компактификация сворачивает
+накопившиеся записи в новый снимок. Запись, чтение и компактификация
+выполняются под файловой блокировкой, поэтому одновременные правки
+нескольких администраторов не затирают друг друга.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from comments_store import report_keys
+
+# Межпроцессная блокировка доступна только на POSIX
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _json_value(value):
+    """Приведение значения ячейки к виду, пригодному для JSON"""
+    if value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+class RegistryJournal:
+    def __init__(self, journal_path, compact_threshold=200):
+        """
+        Журнал правок реестра
+
+        Args:
+            journal_path (Path): путь к файлу журнала (*.jsonl)
+            compact_threshold (int): число записей, после которого запускается компактификация
+        """
+        self.path = Path(journal_path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.compact_threshold = compact_threshold
+
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._compacting = False
+        # (размер файла журнала, число записей) после последней записи этого процесса
+        self._counted = None
+
+    @contextmanager
+    def locked(self):
+        """Эксклюзивная блокировка журнала и снимка (повторный вход разрешен)"""
+        with self._thread_lock:
+            if self._lock_depth > 0 or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_entries(self):
+        """Все записи журнала (незавершенная последняя строка пропускается)"""
+        if not self.path.exists():
+            return []
+
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+    def append_cell_edit(self, key, column, value):
+        """
+        Запись правки одной ячейки
+
+        Args:
+            key (tuple): ключ отчета (Номер формы, Наименование отчета)
+            column (str): столбец реестра
+            value: новое значение
+
+        Returns:
+            int: количество записей в журнале после добавления
+        """
+        entry = {
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'op': 'set_cell',
+            'key': list(key),
+            'column': column,
+            'value': _json_value(value),
+        }
+        with self.locked():
+            size_before = self.path.stat().st_size if self.path.exists() else 0
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                size_after = f.tell()
+
+            # Журнал перечитывается, только если его с прошлого раза менял
+            # другой процесс (размер не совпал) — иначе счетчик увеличивается
+            if self._counted is not None and self._counted[0] == size_before:
+                count = self._counted[1] + 1
+            else:
+                count = len(self.read_entries())
+            self._counted = (size_after, count)
+            return count
+
+    def apply(self, df, entries):
+        """Применение записей журнала к копии DataFrame"""
+        if not entries:
+            return df
+
+        df = df.copy()
+        positions = {}
+        for pos, key in enumerate(report_keys(df)):
+            positions.setdefault(key, []).append(pos)
+
+        for entry in entries:
+            if entry.get('op') != 'set_cell':
+                continue
+            rows = positions.get(tuple(entry['key']))
+            if not rows:
+                continue
+
+            column = entry['column']
+            value = entry['value']
+            if column not in df.columns:
+                df[column] = None
+
+            series = df[column]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                value = pd.to_datetime(value, dayfirst=True, errors='coerce')
+            elif pd.api.types.is_float_dtype(series):
+                try:
+                    value = np.nan if value is None else float(str(value).replace(',', '.').replace(' ', ''))
+                except ValueError:
+                    df[column] = series.astype(object)
+            elif not pd.api.types.is_object_dtype(series):
+                # Значение не укладывается в тип столбца: переводим столбец в object
+                df[column] = series.astype(object)
+
+            col_idx = df.columns.get_loc(column)
+            for pos in rows:
+                df.iat[pos, col_idx] = value
+
+        return df
+
+    def load(self, store, table):
+        """Чтение снимка таблицы с примененным журналом"""
+        with self.locked():
+            df = store.read(table)
+            entries = self.read_entries()
+        if df is None:
+            return None
+        return self.apply(df, entries)
+
+    def reset(self):
+        """Очистка журнала (вызывается под блокировкой при записи нового снимка)"""
+        with self.locked():
+            if self.path.exists():
+                self.path.unlink()
+            self._counted = (0, 0)
+
+    def compact(self, store, table, date_columns=None):
+        """
+        Сворачивание журнала в новый снимок таблицы
+
+        Returns:
+            int: количество свернутых записей
+        """
+        with self.locked():
+            entries = self.read_entries()
+            if not entries:
+                return 0
+            df = store.read(table)
+            if df is not None:
+                store.write(table, self.apply(df, entries), date_columns=date_columns)
+            self.reset()
+            return len(entries)
+
+    def compact_in_background(self, store, table, date_columns=None, on_done=None):
+        """Запуск компактификации в фоновом потоке (не более одной одновременно)"""
+        with self._thread_lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact(store, table, date_columns=date_columns)
+                if on_done is not None:
+                    on_done()
+            finally:
+                with self._thread_lock:
+                    self._compacting = False
+
+        threading.Thread(target=run, name="registry-journal-compactor", daemon=True).start()
+        return True
@@ -0,0 +1,264 @@
+"""
+История загрузок с контентной адресацией.
+
+Каждая загруженная версия реестра или выгрузки запросов сохраняется как
+снимок. Строки снимка делятся на фрагменты по границам, зависящим от
+содержимого (хэш строки), и каждый фрагмент хранится один раз под именем
+своего хэша. Почти одинаковые еженедельные выгрузки поэтому занимают на
+диске только измененные фрагменты, а любую версию можно быстро собрать
+обратно из фрагментов.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import get_backend, parse_date_columns
+
+
+def row_hashes(df):
+    """64-битные хэши строк DataFrame (индекс не учитывается)"""
+    if df.empty:
+        return np.array([], dtype=np.uint64)
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+def chunk_boundaries(hashes, target_rows, max_rows):
+    """
+    Границы фрагментов, зависящие от содержимого строк
+
+    Фрагмент заканчивается на строке, хэш которой делится на target_rows,
+    поэтому вставка или удаление строки сдвигает только соседние границы.
+
+    Returns:
+        list: пары (начало, конец) для срезов iloc
+    """
+    n = len(hashes)
+    cut_points = np.flatnonzero(hashes % np.uint64(target_rows) == 0) + 1
+
+    bounds = []
+    start = 0
+    for cut in list(cut_points) + [n]:
+        while cut - start > max_rows:
+            bounds.append((start, start + max_rows))
+            start += max_rows
+        if cut > start:
+            bounds.append((start, int(cut)))
+            start = int(cut)
+    return bounds
+
+
+class SnapshotStore:
+    def __init__(self, root, backend=None, target_chunk_rows=1024, loaded_versions=2):
+        """
+        Хранилище версий загруженных таблиц
+
+        Args:
+            root (Path): директория истории
+            backend: бэкенд хранения фрагментов (см. storage.get_backend)
+            target_chunk_rows (int): средний размер фрагмента в строках
+            loaded_versions (int): сколько собранных версий держать в памяти
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.manifests_dir = self.root / "manifests"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+
+        self.backend = backend or get_backend()
+        self.target_chunk_rows = target_chunk_rows
+        self.max_chunk_rows = target_chunk_rows * 4
+
+        # Манифесты неизменяемы: список перечитывается, только когда в
+        # директории появился или исчез файл (меняется ее mtime). Имена
+        # файлов тоже сравниваются: две записи за один тик таймера ФС
+        # оставляют mtime прежним
+        self._manifests = {}
+        self._loaded = OrderedDict()
+        self._loaded_versions = loaded_versions
+        self._lock = threading.Lock()
+
+    def _object_path(self, chunk_id):
+        return self.objects_dir / chunk_id[:2] / f"{chunk_id}{self.backend.suffix}"
+
+    def _manifest_dir(self, kind):
+        path = self.manifests_dir / kind
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def list_versions(self, kind):
+        """Манифесты версий, от новых к старым"""
+        manifest_dir = self._manifest_dir(kind)
+        state = (manifest_dir.stat().st_mtime_ns, frozenset(manifest_dir.glob("*.json")))
+        with self._lock:
+            cached = self._manifests.get(kind)
+            if cached is not None and cached[0] == state:
+                return list(cached[1])
+
+        manifests = []
+        for path in state[1]:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifests.append(json.load(f))
+        manifests.sort(key=lambda m: m['created_at'], reverse=True)
+        with self._lock:
+            self._manifests[kind] = (state, manifests)
+        return list(manifests)
+
+    def save(self, kind, df, source_name='', date_columns=None):
+        """
+        Сохранение версии таблицы
+
+        Если содержимое совпадает с последней версией, новая версия не создается.
+
+        Args:
+            kind (str): вид данных (reports, requests)
+            df (pandas.DataFrame): загруженные данные
+            source_name (str): имя загруженного файла
+            date_columns (list): столбцы, которые нужно сохранить как даты
+
+        Returns:
+            dict: манифест версии
+        """
+        return self.save_batches(kind, [df], source_name, date_columns)
+
+    def save_batches(self, kind, batches, source_name='', date_columns=None):
+        """
+        Сохранение версии таблицы, переданной порциями строк
+
+        Фрагменты пишутся по мере поступления порций, поэтому в памяти
+        одновременно только текущая порция и хвост незакрытого фрагмента.
+        Границы фрагментов и хэши совпадают с сохранением той же таблицы
+        одним DataFrame (см. save).
+
+        Args:
+            kind (str): вид данных (reports, requests)
+            batches: порции строк (pandas.DataFrame с одинаковыми столбцами)
+            source_name (str): имя загруженного файла
+            date_columns (list): столбцы, которые нужно сохранить как даты
+
+        Returns:
+            dict: манифест версии
+        """
+        schema = None
+        columns = []
+        content = hashlib.sha256()
+        rows = 0
+        chunks = []
+        # Строки после последней границы фрагмента и их хэши: фрагмент
+        # может продолжиться в следующей порции
+        tail = None
+        for df in batches:
+            df = self.backend.prepare(parse_date_columns(df, date_columns))
+            hashes = row_hashes(df)
+            if schema is None:
+                columns = list(df.columns)
+                schema = json.dumps([[col, str(dtype)] for col, dtype in df.dtypes.items()], ensure_ascii=False)
+                content.update(schema.encode('utf-8'))
+            content.update(hashes.tobytes())
+            rows += len(df)
+
+            if tail is not None:
+                df = pd.concat([tail[0], df], ignore_index=True)
+                hashes = np.concatenate([tail[1], hashes])
+            bounds = chunk_boundaries(hashes, self.target_chunk_rows, self.max_chunk_rows)
+            tail = None
+            if bounds and hashes[-1] % np.uint64(self.target_chunk_rows) != 0:
+                start, _ = bounds.pop()
+                tail = (df.iloc[start:].reset_index(drop=True), hashes[start:])
+            for start, end in bounds:
+                chunks.append(self._save_chunk(schema, df.iloc[start:end], hashes[start:end]))
+
+        if tail is not None:
+            chunks.append(self._save_chunk(schema, tail[0], tail[1]))
+
+        content_hash = content.hexdigest()
+        versions = self.list_versions(kind)
+        if versions and versions[0]['content_hash'] == content_hash:
+            return versions[0]
+
+        created_at = datetime.now()
+        manifest = {
+            'version_id': f"{created_at.strftime('%Y%m%d_%H%M%S_%f')}_{content_hash[:12]}",
+            'kind': kind,
+            'created_at': created_at.isoformat(),
+            'source_name': source_name,
+            'rows': rows,
+            'columns': columns,
+            'content_hash': content_hash,
+            'chunks': chunks,
+        }
+        manifest_path = self._manifest_dir(kind) / f"{manifest['version_id']}.json"
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+    def _save_chunk(self, schema, df, hashes):
+        """Запись фрагмента под именем его хэша (если такого еще нет)"""
+        chunk_id = hashlib.sha256(schema.encode('utf-8') + hashes.tobytes()).hexdigest()
+        path = self._object_path(chunk_id)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+            self.backend.write(df.reset_index(drop=True), tmp_path)
+            os.replace(tmp_path, path)
+        return {'id': chunk_id, 'rows': len(df)}
+
+    def get_manifest(self, kind, version_id):
+        with open(self._manifest_dir(kind) / f"{version_id}.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, kind, version_id):
+        """Сборка версии из фрагментов (последние собранные версии берутся из памяти)"""
+        with self._lock:
+            if (kind, version_id) in self._loaded:
+                self._loaded.move_to_end((kind, version_id))
+                return self._loaded[(kind, version_id)].copy()
+
+        df = self._assemble(kind, version_id)
+        with self._lock:
+            self._loaded[(kind, version_id)] = df
+            while len(self._loaded) > self._loaded_versions:
+                self._loaded.popitem(last=False)
+        return df.copy()
+
+    def _assemble(self, kind, version_id):
+        manifest = self.get_manifest(kind, version_id)
+        if not manifest['chunks']:
+            return pd.DataFrame(columns=manifest['columns'])
+
+        paths = [self._object_path(chunk['id']) for chunk in manifest['chunks']]
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as executor:
+            parts = list(executor.map(self.backend.read, paths))
+
+        df = pd.concat(parts, ignore_index=True)
+        return df[manifest['columns']]
+
+    def diff_summary(self, old_df, new_df, date_columns=None):
+        """
+        Сравнение двух версий по хэшам строк
+
+        Returns:
+            dict: количество добавленных, удаленных и общих строк
+        """
+        old_df = self.backend.prepare(parse_date_columns(old_df, date_columns))
+        new_df = self.backend.prepare(parse_date_columns(new_df, date_columns))
+        old_hashes = pd.Series(row_hashes(old_df)).value_counts()
+        new_hashes = pd.Series(row_hashes(new_df)).value_counts()
+        common = old_hashes.align(new_hashes, fill_value=0)
+        shared = int(np.minimum(common[0], common[1]).sum())
+        return {
+            'added': int(new_hashes.sum()) - shared,
+            'removed': int(old_hashes.sum()) - shared,
+            'unchanged': shared,
+        }
+
+    def disk_usage(self):
+        """Размер всех фрагментов на диске в байтах"""
+        return sum(path.stat().st_size for path in self.objects_dir.rglob(f"*{self.backend.suffix}"))
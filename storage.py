@@ -0,0 +1,472 @@
+"""
+Хранилище данных дашборда.
+
+Канонические копии таблиц хранятся в колоночном формате (Parquet или Arrow IPC)
+с сохранением типов столбцов и распарсенными датами. Excel используется только
+для импорта/экспорта и как запасной вариант, если pyarrow не установлен.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from ingest import read_excel
+
+# Безопасный импорт pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Типы object-столбцов, которые Arrow сохраняет без приведения к строке
+ARROW_SAFE_INFERRED_TYPES = {
+    'string', 'empty', 'integer', 'floating', 'mixed-integer-float',
+    'boolean', 'datetime', 'datetime64', 'date', 'decimal', 'bytes'
+}
+
+# Размер порции строк при чтении таблицы по частям
+READ_BATCH_ROWS = 100_000
+
+# Форматы дат, которые встречаются в выгрузках (проверяются по порядку)
+DATE_FORMATS = ['%d.%m.%Y', '%Y-%m-%d', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+
+def parse_datetime_column(series):
+    """
+    Преобразование столбца в datetime без потери значений
+
+    Столбец конвертируется только если все непустые значения распознаны как даты,
+    иначе возвращается без изменений.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    non_empty = series.notna() & (series.astype(str).str.strip() != '')
+    expected = int(non_empty.sum())
+    if expected == 0:
+        return series
+
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(series, format=fmt, errors='coerce')
+        if int(parsed.notna().sum()) == expected:
+            return parsed
+
+    # Смешанные форматы в одном столбце: каждое значение разбирается отдельно
+    for kwargs in ({'format': 'mixed'}, {}):
+        try:
+            parsed = pd.to_datetime(series, dayfirst=True, errors='coerce', **kwargs)
+        except (TypeError, ValueError):
+            continue
+        if int(parsed.notna().sum()) == expected:
+            return parsed
+    return series
+
+
+def parse_date_columns(df, date_columns):
+    """Копия DataFrame с распарсенными столбцами дат"""
+    df = df.copy()
+    for col in date_columns or []:
+        if col in df.columns:
+            df[col] = parse_datetime_column(df[col])
+    return df
+
+
+def normalize_for_arrow(df):
+    """Приведение DataFrame к виду, который Arrow сохраняет без ошибок"""
+    df = df.copy()
+
+    # Arrow требует строковые названия столбцов
+    if not all(isinstance(col, str) for col in df.columns):
+        df.columns = [str(col) for col in df.columns]
+
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+        if inferred not in ARROW_SAFE_INFERRED_TYPES:
+            # Смешанные типы (например, числа и строки в "Номер формы") храним строками
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+
+    return df.reset_index(drop=True)
+
+
+class ParquetBackend:
+    """Хранение таблиц в формате Parquet"""
+    name = "parquet"
+    suffix = ".parquet"
+
+    def prepare(self, df):
+        return normalize_for_arrow(df)
+
+    def read(self, path):
+        return pd.read_parquet(path)
+
+    def read_batches(self, path, batch_rows):
+        parquet_file = pq.ParquetFile(path)
+        if parquet_file.metadata.num_rows == 0:
+            yield parquet_file.schema_arrow.empty_table().to_pandas()
+            return
+        for batch in parquet_file.iter_batches(batch_size=batch_rows):
+            yield batch.to_pandas()
+
+    def write(self, df, path):
+        df.to_parquet(path, index=False)
+
+    def open_writer(self, path, schema):
+        """Запись таблицы по частям (pyarrow.Table с общей схемой)"""
+        return pq.ParquetWriter(path, schema)
+
+
+class ArrowBackend:
+    """Хранение таблиц в формате Arrow IPC (Feather v2)"""
+    name = "arrow"
+    suffix = ".arrow"
+
+    def prepare(self, df):
+        return normalize_for_arrow(df)
+
+    def read(self, path):
+        return pd.read_feather(path)
+
+    def read_batches(self, path, batch_rows):
+        with pa.memory_map(str(path)) as source:
+            reader = pa.ipc.open_file(source)
+            if reader.num_record_batches == 0:
+                yield reader.schema.empty_table().to_pandas()
+                return
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for offset in range(0, max(batch.num_rows, 1), batch_rows):
+                    yield batch.slice(offset, batch_rows).to_pandas()
+
+    def write(self, df, path):
+        df.to_feather(path)
+
+    def open_writer(self, path, schema):
+        """Запись таблицы по частям (pyarrow.Table с общей схемой)"""
+        return pa.ipc.new_file(str(path), schema)
+
+
+class ExcelBackend:
+    """Хранение таблиц в Excel (используется, если pyarrow недоступен)"""
+    name = "excel"
+    suffix = ".xlsx"
+
+    def prepare(self, df):
+        return df
+
+    def read(self, path):
+        return read_excel(path)
+
+    def read_batches(self, path, batch_rows):
+        # Excel читается только целиком
+        yield self.read(path)
+
+    def write(self, df, path):
+        df.to_excel(path, index=False)
+
+
+STORAGE_BACKENDS = {
+    ParquetBackend.name: ParquetBackend,
+    ArrowBackend.name: ArrowBackend,
+    ExcelBackend.name: ExcelBackend,
+}
+
+
+def get_backend(name=None):
+    """
+    Получение бэкенда хранения по имени
+
+    Args:
+        name (str): parquet, arrow или excel (по умолчанию parquet)
+
+    Returns:
+        бэкенд хранения; без pyarrow всегда возвращается Excel
+    """
+    name = (name or ParquetBackend.name).lower()
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Неизвестный формат хранения: {name}")
+    if name != ExcelBackend.name and not PYARROW_AVAILABLE:
+        name = ExcelBackend.name
+    return STORAGE_BACKENDS[name]()
+
+
+class DataStore:
+    def __init__(self, data_dir, backend=None):
+        """
+        Хранилище именованных таблиц в директории данных
+
+        Args:
+            data_dir (Path): директория с файлами данных
+            backend: бэкенд хранения (см. get_backend)
+        """
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.backend = backend or get_backend()
+
+    def path(self, name):
+        """Путь к канонической копии таблицы"""
+        return self.data_dir / f"{name}{self.backend.suffix}"
+
+    def legacy_path(self, name):
+        """Путь к xlsx-файлу таблицы из предыдущих версий приложения"""
+        return self.data_dir / f"{name}.xlsx"
+
+    def exists(self, name):
+        return self.path(name).exists()
+
+    def read(self, name):
+        """Чтение таблицы; None, если таблица еще не сохранялась"""
+        path = self.path(name)
+        if not path.exists():
+            return None
+        return self.backend.read(path)
+
+    def read_batches(self, name, batch_rows=READ_BATCH_ROWS):
+        """
+        Чтение таблицы порциями строк (таблица целиком в память не загружается)
+
+        Yields:
+            pandas.DataFrame: очередная порция; для пустой таблицы — одна пустая
+        """
+        path = self.path(name)
+        if not path.exists():
+            return
+        yield from self.backend.read_batches(path, batch_rows)
+
+    def write(self, name, df, date_columns=None):
+        """
+        Атомарная запись таблицы
+
+        Args:
+            name (str): имя таблицы
+            df (pandas.DataFrame): данные
+            date_columns (list): столбцы, которые нужно сохранить как даты
+        """
+        df = self.backend.prepare(parse_date_columns(df, date_columns))
+
+        path = self.path(name)
+        tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+        try:
+            self.backend.write(df, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def chunked_writer(self, name, date_columns=None):
+        """Запись таблицы по фрагментам (см. ChunkedTableWriter)"""
+        return ChunkedTableWriter(self, name, date_columns)
+
+    def delete(self, name):
+        path = self.path(name)
+        if path.exists():
+            path.unlink()
+
+    def migrate_legacy_excel(self, name, date_columns=None):
+        """
+        Однократный перенос xlsx-файла таблицы в канонический формат
+
+        Исходный файл переименовывается в *.xlsx.migrated и больше не читается.
+
+        Returns:
+            bool: True, если миграция выполнена
+        """
+        legacy = self.legacy_path(name)
+        if self.backend.suffix == legacy.suffix:
+            return False
+        if self.path(name).exists() or not legacy.exists():
+            return False
+
+        df = read_excel(legacy)
+        self.write(name, df, date_columns=date_columns)
+        legacy.rename(legacy.with_name(legacy.name + ".migrated"))
+        return True
+
+
+def _common_arrow_type(types):
+    """Тип столбца, в который без потерь приводятся типы всех фрагментов"""
+    types = {t for t in types if not pa.types.is_null(t)}
+    if not types:
+        return pa.null()
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    # Разные типы в разных фрагментах (например, числа и строки) храним строками
+    return pa.string()
+
+
+class ChunkedTableWriter:
+    def __init__(self, store, name, date_columns=None):
+        """
+        Запись большой таблицы по фрагментам
+
+        Фрагменты сохраняются во временные файлы по мере чтения, поэтому
+        таблица целиком в памяти не собирается. commit() приводит фрагменты
+        к общей схеме (типы столбцов в разных фрагментах могут различаться)
+        и атомарно заменяет таблицу. Без pyarrow фрагменты копятся в памяти
+        и записываются обычным способом.
+
+        Args:
+            store (DataStore): хранилище
+            name (str): имя таблицы
+            date_columns (list): столбцы, которые нужно сохранить как даты
+        """
+        self.store = store
+        self.name = name
+        self.date_columns = date_columns
+        self.rows = 0
+        self._frames = []
+        self._parts = []
+        self._parts_dir = None
+
+    def write(self, df):
+        """Добавление фрагмента в конец таблицы"""
+        self.rows += len(df)
+        if isinstance(self.store.backend, ExcelBackend):
+            self._frames.append(df)
+            return
+
+        if self._parts_dir is None:
+            self._parts_dir = Path(tempfile.mkdtemp(prefix=f".{self.name}.parts.", dir=self.store.data_dir))
+        df = self.store.backend.prepare(parse_date_columns(df, self.date_columns))
+        path = self._parts_dir / f"{len(self._parts):06d}.parquet"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+        self._parts.append(path)
+
+    def commit(self):
+        """Атомарная замена таблицы записанными фрагментами"""
+        try:
+            if isinstance(self.store.backend, ExcelBackend):
+                frames = self._frames or [pd.DataFrame()]
+                self.store.write(self.name, pd.concat(frames, ignore_index=True), self.date_columns)
+                return
+            if not self._parts:
+                self.store.write(self.name, pd.DataFrame())
+                return
+
+            schemas = [pq.read_schema(path) for path in self._parts]
+            schema = pa.schema([
+                pa.field(name, _common_arrow_type(schema.field(name).type for schema in schemas))
+                for name in schemas[0].names
+            ])
+
+            path = self.store.path(self.name)
+            tmp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+            try:
+                writer = self.store.backend.open_writer(tmp_path, schema)
+                try:
+                    for part in self._parts:
+                        writer.write_table(pq.read_table(part).select(schema.names).cast(schema))
+                finally:
+                    writer.close()
+                os.replace(tmp_path, path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Удаление записанных фрагментов без изменения таблицы"""
+        self._frames = []
+        self._parts = []
+        if self._parts_dir is not None:
+            shutil.rmtree(self._parts_dir, ignore_errors=True)
+            self._parts_dir = None
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DatasetCache:
+    def __init__(self):
+        """
+        Общий для процесса кэш загруженных таблиц
+
+        Все сессии Streamlit получают один и тот же объект DataFrame, который
+        нужно использовать только для чтения. Запись ключуется версией файлов:
+        (mtime, размер) определяют, нужно ли пересчитывать хэш содержимого,
+        а сам хэш — нужно ли перечитывать данные.
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+        self._digests = {}
+
+    def file_version(self, path):
+        """Хэш содержимого файла (None, если файла нет)"""
+        path = Path(path)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        quick_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(str(path))
+        if cached is not None and cached[0] == quick_key:
+            return cached[1]
+
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[str(path)] = (quick_key, digest)
+        return digest
+
+    def version(self, paths):
+        """Версия набора файлов"""
+        return tuple(self.file_version(p) for p in paths)
+
+    def get(self, key, paths, loader):
+        """
+        Получение значения из кэша с загрузкой при изменении файлов
+
+        Args:
+            key (str): имя записи кэша
+            paths (list): файлы, от которых зависит значение
+            loader: функция без аргументов, загружающая значение
+
+        Returns:
+            tuple: (значение, версия)
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Одновременные сессии ждут одну загрузку, а не читают файл каждая
+        with key_lock:
+            version = self.version(paths)
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1], version
+
+            value = loader()
+            with self._lock:
+                self._entries[key] = (version, value)
+            return value, version
+
+    def invalidate(self, key=None):
+        """Сброс записи кэша (или всего кэша)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._digests.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+# Единый кэш на процесс: модуль импортируется один раз и переживает перезапуски скрипта
+dataset_cache = DatasetCache()
@@ -0,0 +1,349 @@
+"""
+Определение типа данных столбцов шаблона отчета.
+
+Значение считается датой, если разбирается одним из DATE_FORMATS или
+pd.to_datetime, и числом, если разбирается float после замены запятой
+и удаления пробелов. Столбец обрабатывается целиком: значения сводятся к
+уникальным строкам с частотами, очевидные случаи отсекаются регулярными
+выражениями и разбором по формату, а оставшиеся строки разбираются
+пакетами до тех пор, пока доля дат не станет однозначно выше или ниже
+порога.
+
+Для очень длинных столбцов доступен выборочный режим: тип определяется по
+стратифицированной выборке, а полный просмотр выполняется только если доля
+дат или чисел в выборке попадает в пределы погрешности около порога.
+
+Широкие шаблоны (сотни столбцов) обрабатываются пакетами столбцов в пуле
+процессов; небольшие таблицы — последовательно, без накладных расходов пула.
+Пул один на процесс: одновременные вызовы (например, из потоков пакетной
+обработки шаблонов) делят его ядра, а не запускают каждый свой пул.
+"""
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Метки типов
+TYPE_TEXT = "текст"
+TYPE_NUMBER = "число"
+TYPE_DATE = "дата"
+TYPE_FLAG = "флаг"
+
+# Значения, по которым столбец считается флагом
+BOOL_INDICATORS = {
+    'да', 'нет', 'true', 'false', '1', '0', 'yes', 'no',
+    'y', 'n', 'вкл', 'выкл', 'on', 'off', 'активен', 'неактивен'
+}
+
+# Форматы дат, которые проверяются до общего разбора
+DATE_FORMATS = [
+    '%d.%m.%Y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y',
+    '%d.%m.%y', '%d/%m/%y', '%y-%m-%d', '%d-%m-%y',
+    '%Y.%m.%d', '%Y/%m/%d'
+]
+
+# Доли значений, начиная с которых столбец считается датой или числом
+DATE_SHARE_THRESHOLD = 0.7
+NUMERIC_SHARE_THRESHOLD = 0.8
+
+# Строки, которые pd.to_datetime превращает в NaT без ошибки (считаются датами)
+NAT_STRINGS = {'', 'nan', 'NaN', 'NAN', 'NaT', 'nat', 'NAT'}
+
+# Кириллица не разбирается ни одним парсером дат
+CYRILLIC_PATTERN = r'[А-Яа-яЁё]'
+NUMERIC_DATE_PATTERN = r'^\d{1,4}[./-]\d{1,2}[./-]\d{1,4}$'
+
+# Размер первого пакета при общем разборе дат (далее удваивается)
+DATE_PARSE_BATCH = 1024
+
+# Размер выборки по умолчанию и квантиль нормального распределения для погрешности (95%)
+DEFAULT_SAMPLE_SIZE = 2000
+SAMPLE_Z = 1.96
+
+# Пул процессов используется начиная с этого числа столбцов и ячеек
+# (запуск задания в пуле окупается только на действительно больших таблицах)
+PARALLEL_MIN_COLUMNS = 64
+PARALLEL_MIN_CELLS = 2_000_000
+# Количество столбцов в одном задании пула
+PARALLEL_BATCH_COLUMNS = 32
+
+
+def value_counts(values):
+    """Частоты непустых значений столбца в строковом виде (как str(value).strip())"""
+    clean_values = values.dropna()
+    return clean_values.astype(str).str.strip().value_counts(sort=True)
+
+
+def _is_float(value):
+    try:
+        float(value.replace(',', '.').replace(' ', ''))
+        return True
+    except ValueError:
+        return False
+
+
+def count_numeric(counts, dtype=None):
+    """Количество значений, которые float() принимает после замены ',' и удаления пробелов"""
+    total = int(counts.sum())
+    if dtype is not None and (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_float_dtype(dtype)):
+        return total
+    if total == 0:
+        return 0
+    mask = np.fromiter((_is_float(value) for value in counts.index), dtype=bool, count=len(counts))
+    return int(counts.to_numpy()[mask].sum())
+
+
+def _date_mask_by_format(strings):
+    """Строки, разбираемые одним из форматов DATE_FORMATS"""
+    mask = np.zeros(len(strings), dtype=bool)
+    candidates = strings.str.match(NUMERIC_DATE_PATTERN).to_numpy()
+    if not candidates.any():
+        return mask
+    # Каждый следующий формат проверяется только на еще не распознанных строках
+    pending = np.flatnonzero(candidates)
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(strings.iloc[pending], format=fmt, errors='coerce').notna().to_numpy()
+        mask[pending[parsed]] = True
+        pending = pending[~parsed]
+        if len(pending) == 0:
+            break
+    return mask
+
+
+def count_dates(counts, dtype=None, threshold=None):
+    """
+    Количество значений, распознаваемых как дата
+
+    Args:
+        counts (pandas.Series): частоты значений (см. value_counts)
+        dtype: исходный тип столбца
+        threshold (float): если задан, разбор прекращается, как только доля дат
+            однозначно выше или ниже порога; результат тогда точен только
+            относительно порога
+
+    Returns:
+        int: количество дат
+    """
+    total = int(counts.sum())
+    if total == 0:
+        return 0
+    if dtype is not None and pd.api.types.is_datetime64_any_dtype(dtype):
+        return total
+
+    strings = pd.Series(counts.index, dtype=object)
+    weights = counts.to_numpy()
+
+    is_date = strings.isin(NAT_STRINGS).to_numpy() | _date_mask_by_format(strings)
+    undecided = ~is_date & ~strings.str.contains(CYRILLIC_PATTERN).to_numpy()
+
+    date_count = int(weights[is_date].sum())
+    pending = np.flatnonzero(undecided)
+    remaining = int(weights[pending].sum())
+
+    batch = DATE_PARSE_BATCH
+    start = 0
+    while start < len(pending):
+        if threshold is not None:
+            if date_count / total > threshold or (date_count + remaining) / total <= threshold:
+                break
+        idx = pending[start:start + batch]
+        parsed = pd.to_datetime(strings.iloc[idx], format='mixed', errors='coerce').notna().to_numpy()
+        date_count += int(weights[idx][parsed].sum())
+        remaining -= int(weights[idx].sum())
+        start += batch
+        batch *= 2
+
+    return date_count
+
+
+def is_flag(counts):
+    """Все значения — индикаторы да/нет и различных значений не больше трех"""
+    unique_values = set(value.lower() for value in counts.index)
+    return unique_values.issubset(BOOL_INDICATORS) and len(unique_values) <= 3
+
+
+def detect_data_type(values):
+    """
+    Определение типа данных столбца
+
+    Args:
+        values: pandas Series с данными столбца
+
+    Returns:
+        str: тип данных ('текст', 'число', 'дата', 'флаг')
+    """
+    counts = value_counts(values)
+    total = int(counts.sum())
+    if total == 0:
+        return TYPE_TEXT
+
+    if is_flag(counts):
+        return TYPE_FLAG
+
+    if count_dates(counts, values.dtype, threshold=DATE_SHARE_THRESHOLD) / total > DATE_SHARE_THRESHOLD:
+        return TYPE_DATE
+
+    if count_numeric(counts, values.dtype) / total > NUMERIC_SHARE_THRESHOLD:
+        return TYPE_NUMBER
+
+    return TYPE_TEXT
+
+
+def stratified_sample(values, sample_size, random_state=0):
+    """
+    Стратифицированная выборка значений столбца
+
+    Столбец делится на sample_size равных участков, из каждого берется одно
+    случайное значение, поэтому выборка покрывает и начало, и конец таблицы.
+    """
+    n = len(values)
+    if n <= sample_size:
+        return values
+    rng = np.random.default_rng(random_state)
+    bounds = np.linspace(0, n, sample_size + 1)
+    positions = np.floor(bounds[:-1] + rng.random(sample_size) * np.diff(bounds)).astype(int)
+    return values.iloc[np.minimum(positions, n - 1)]
+
+
+def _normal_cdf(x):
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+def _share_decision(hits, sample_n, population_n, threshold):
+    """
+    Решение «доля выше порога» по выборке
+
+    Returns:
+        tuple: (доля выше порога, уверенность) или None, если порог в пределах погрешности
+    """
+    share = hits / sample_n
+    # Сглаживание, чтобы доля 0 или 1 в выборке не давала нулевую погрешность
+    smoothed = (hits + 1) / (sample_n + 2)
+    fpc = math.sqrt(max(population_n - sample_n, 0) / max(population_n - 1, 1))
+    se = math.sqrt(smoothed * (1 - smoothed) / sample_n) * fpc
+    if se == 0:
+        return share > threshold, 1.0
+    if abs(share - threshold) <= SAMPLE_Z * se:
+        return None
+    return share > threshold, _normal_cdf(abs(share - threshold) / se)
+
+
+def detect_data_type_sampled(values, sample_size=DEFAULT_SAMPLE_SIZE, random_state=0):
+    """
+    Определение типа данных столбца по выборке
+
+    Если столбец не длиннее выборки или доля дат/чисел в выборке близка к порогу,
+    выполняется полный просмотр (уверенность 1.0).
+
+    Уверенность относится к переданным значениям: если values — первые строки
+    файла, это уверенность для них, а не для всего файла.
+
+    Args:
+        values: pandas Series с данными столбца
+        sample_size (int): размер выборки
+        random_state (int): начальное значение генератора (выборка воспроизводима)
+
+    Returns:
+        tuple: (тип данных, уверенность от 0 до 1)
+    """
+    clean_values = values.dropna()
+    if len(clean_values) <= sample_size:
+        return detect_data_type(values), 1.0
+
+    counts = value_counts(stratified_sample(clean_values, sample_size, random_state))
+    sample_n = int(counts.sum())
+    population_n = len(clean_values)
+
+    # Флаг определяется только по всему столбцу: одно лишнее значение меняет тип
+    if is_flag(counts):
+        return detect_data_type(values), 1.0
+
+    confidence = 1.0
+    date_decision = _share_decision(count_dates(counts, values.dtype), sample_n, population_n, DATE_SHARE_THRESHOLD)
+    if date_decision is None:
+        return detect_data_type(values), 1.0
+    is_date, date_confidence = date_decision
+    confidence *= date_confidence
+    if is_date:
+        return TYPE_DATE, confidence
+
+    numeric_decision = _share_decision(count_numeric(counts, values.dtype), sample_n, population_n, NUMERIC_SHARE_THRESHOLD)
+    if numeric_decision is None:
+        return detect_data_type(values), 1.0
+    is_numeric, numeric_confidence = numeric_decision
+    confidence *= numeric_confidence
+
+    return (TYPE_NUMBER if is_numeric else TYPE_TEXT), confidence
+
+
+def _detect_column(values, sample_size):
+    if sample_size is None:
+        return detect_data_type(values), 1.0
+    return detect_data_type_sampled(values, sample_size)
+
+
+def _detect_batch(batch, sample_size):
+    """Типы столбцов пакета (выполняется в процессе пула)"""
+    return [_detect_column(batch.iloc[:, pos], sample_size) for pos in range(batch.shape[1])]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Общий для процесса пул (создается при первом обращении)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: процесс Streamlit многопоточный, fork из него небезопасен
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def _reset_pool(pool):
+    """Замена сломанного пула (например, после аварийного завершения процесса)"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def detect_column_types(df, sample_size=None, max_workers=None):
+    """
+    Типы всех столбцов таблицы
+
+    Args:
+        df (pandas.DataFrame): исходные данные
+        sample_size (int): размер выборки (по умолчанию None — полный просмотр
+            каждого столбца, типы совпадают с построчной проверкой)
+        max_workers (int): число доступных ядер (по умолчанию os.cpu_count());
+            меньше 2 — последовательная обработка без пула
+
+    Returns:
+        list: пары (тип данных, уверенность) в порядке столбцов df
+    """
+    n_rows, n_columns = df.shape
+    max_workers = max_workers or os.cpu_count() or 1
+    if n_columns < PARALLEL_MIN_COLUMNS or n_rows * n_columns < PARALLEL_MIN_CELLS or max_workers < 2:
+        return _detect_batch(df, sample_size)
+
+    batches = [df.iloc[:, start:start + PARALLEL_BATCH_COLUMNS] for start in range(0, n_columns, PARALLEL_BATCH_COLUMNS)]
+    pool = None
+    try:
+        pool = _get_pool()
+        results = pool.map(_detect_batch, batches, [sample_size] * len(batches))
+        return [column_type for batch_types in results for column_type in batch_types]
+    except Exception:
+        # Пул недоступен (ограничения окружения, ошибка сериализации) — считаем последовательно
+        if pool is not None and getattr(pool, '_broken', False):
+            _reset_pool(pool)
+        return _detect_batch(df, sample_size)
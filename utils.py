@@ -3,6 +3,7 @@ import numpy as np
 from datetime import datetime, timedelta
 import io
 import streamlit as st
+from ingest import EXCEL_EXTENSIONS, aggregate_request_history_csv, format_read_timing, read_excel
 
 # Безопасный импорт workalendar
 try:
@@ -59,10 +60,8 @@ def calculate_business_days(start_date, end_date):
         # В случае ошибки возвращаем 0
         return 0
 
-def process_data(df):
-    """Обработка данных согласно требованиям"""
-    
-    # Конвертируем даты - добавлена обработка ошибок
+def convert_dates(df):
+    """Конвертация столбцов дат выгрузки (на месте)"""
     date_columns = ['created_at', 'ts_from', 'ts_to']
     for col in date_columns:
         if col in df.columns:
@@ -74,6 +73,13 @@ def process_data(df):
                     df[col] = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
                 except:
                     df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+def process_data(df):
+    """Обработка данных согласно требованиям"""
+    
+    # Конвертируем даты - добавлена обработка ошибок
+    convert_dates(df)
     
     # Сортируем по created_at от новых к старым
     df_sorted = df.sort_values('created_at', ascending=False)
@@ -86,6 +92,12 @@ def process_data(df):
         lambda x: x.loc[x['ts_from'].idxmax()] if x['ts_from'].notna().any() else x.iloc[-1]
     ).reset_index(drop=True)
     
+    return summarize_requests(unique_requests, latest_records)
+
+def summarize_requests(unique_requests, latest_records):
+    """Итоговая таблица по самой новой строке и строке с последним ts_from каждого запроса"""
+    latest_ts_from = dict(zip(latest_records['business_id'], latest_records['ts_from']))
+    
     # Создаем итоговую таблицу
     result_data = []
     
@@ -93,11 +105,11 @@ def process_data(df):
         business_id = unique_row['business_id']
         
         # Находим соответствующую последнюю запись для расчета дней
-        latest_row = latest_records[latest_records['business_id'] == business_id].iloc[0]
+        ts_from = latest_ts_from[business_id]
         
         # Рассчитываем дни в работе (рабочие дни)
-        if pd.notna(latest_row['ts_from']):
-            days_in_work = calculate_business_days(latest_row['ts_from'], datetime.now())
+        if pd.notna(ts_from):
+            days_in_work = calculate_business_days(ts_from, datetime.now())
         else:
             days_in_work = 0
         
@@ -109,7 +121,7 @@ def process_data(df):
             'report_code': unique_row.get('report_code', ''),
             'report_name': unique_row.get('report_name', ''),
             'current_stage': unique_row.get('current_stage', ''),
-            'ts_from': latest_row['ts_from'].strftime('%d.%m.%Y') if pd.notna(latest_row['ts_from']) else '',
+            'ts_from': ts_from.strftime('%d.%m.%Y') if pd.notna(ts_from) else '',
             'analyst': unique_row.get('analyst', ''),
             'request_owner': unique_row.get('request_owner', ''),
             'request_owner_ssp': unique_row.get('request_owner_ssp', '')
@@ -151,8 +163,8 @@ def display_request_analysis():
     
     uploaded_file = st.file_uploader(
         "Выберите файл с данными о запросах",
-        type=['csv', 'xlsx'],
-        help="Поддерживаются файлы в форматах CSV, XLSX"
+        type=['csv', 'xlsx', 'xlsm', 'xls', 'xlsb', 'ods'],
+        help="Поддерживаются файлы в форматах CSV, XLSX, XLSM, XLS, XLSB, ODS"
     )
     
     # Автоматическая загрузка и анализ файла
@@ -162,11 +174,21 @@ def display_request_analysis():
             file_extension = uploaded_file.name.split('.')[-1].lower()
             
             if file_extension == 'csv':
-                # Чтение CSV файла
-                df = pd.read_csv(uploaded_file, encoding='utf-8')
-            elif file_extension == 'xlsx':
-                # Чтение Excel файла
-                df = pd.read_excel(uploaded_file)
+                # CSV сворачивается по фрагментам: файл целиком в память не загружается
+                aggregator = aggregate_request_history_csv(uploaded_file, prepare_chunk=convert_dates)
+                st.success(f"✅ Файл успешно загружен! Найдено {aggregator.rows} записей.")
+                
+                try:
+                    processed_data = summarize_requests(*aggregator.result())
+                    st.success("✅ Данные успешно обработаны!")
+                    display_results(processed_data)
+                except Exception as e:
+                    st.error(f"❌ Ошибка при обработке данных: {str(e)}")
+                return
+            elif f".{file_extension}" in EXCEL_EXTENSIONS:
+                # Чтение Excel файла (быстрый движок, если установлен)
+                df = read_excel(uploaded_file)
+                st.caption(format_read_timing(df))
             else:
                 st.error("❌ Неподдерживаемый формат файла!")
                 return